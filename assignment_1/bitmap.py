@@ -0,0 +1,171 @@
+import numpy as np
+
+
+CONTAINER_BITS = 16
+CONTAINER_SIZE = 1 << CONTAINER_BITS
+# Above this cardinality a sorted array of 16 bit ids takes more space than the packed bits of a container
+ARRAY_CONTAINER_MAX = 4096
+BITS_DTYPE = np.dtype('<u8')
+
+
+def array_to_bits(container):
+    bits = np.zeros(CONTAINER_SIZE, dtype=bool)
+    bits[container] = True
+    return np.packbits(bits, bitorder='little').view(BITS_DTYPE)
+
+
+def bits_to_array(container):
+    return np.flatnonzero(np.unpackbits(container.view(np.uint8), bitorder='little')).astype(np.uint16)
+
+
+def is_bits(container):
+    return container.dtype == BITS_DTYPE
+
+
+def to_bits(container):
+    return container if is_bits(container) else array_to_bits(container)
+
+
+def container_cardinality(container):
+    return int(np.unpackbits(container.view(np.uint8)).sum()) if is_bits(container) else len(container)
+
+
+def optimise_container(container):
+    """Stores a container as a sorted array or as packed bits, whichever is smaller. Empty containers become None"""
+    cardinality = container_cardinality(container)
+
+    if cardinality == 0:
+        return None
+    if is_bits(container) and cardinality <= ARRAY_CONTAINER_MAX:
+        return bits_to_array(container)
+    if not is_bits(container) and cardinality > ARRAY_CONTAINER_MAX:
+        return array_to_bits(container)
+    return container
+
+
+def clear_bits_from(bits, start):
+    """Clears the packed bits of the ids from `start` to the end of the container, in place"""
+    if start >= CONTAINER_SIZE:
+        return
+    word, bit = start >> 6, start & 63
+    if bit:
+        bits[word] &= BITS_DTYPE.type((1 << bit) - 1)
+        word += 1
+    bits[word:] = 0
+
+
+def contains(bits, container):
+    """Tests which ids of an array container are set in a container of packed bits"""
+    words = bits[container >> 6]
+    return ((words >> (container & 63).astype(BITS_DTYPE)) & 1).astype(bool)
+
+
+def and_containers(a, b):
+    if not is_bits(a) and not is_bits(b):
+        return np.intersect1d(a, b, assume_unique=True)
+    if not is_bits(a):
+        return a[contains(b, a)]
+    if not is_bits(b):
+        return b[contains(a, b)]
+    return a & b
+
+
+def or_containers(a, b):
+    if not is_bits(a) and not is_bits(b) and len(a) + len(b) <= ARRAY_CONTAINER_MAX:
+        return np.union1d(a, b)
+    return to_bits(a) | to_bits(b)
+
+
+def andnot_containers(a, b):
+    if not is_bits(a):
+        return a[~contains(b, a)] if is_bits(b) else np.setdiff1d(a, b, assume_unique=True)
+    return a & ~to_bits(b)
+
+
+class Bitmap:
+    """A compressed bitmap of document ids, in the style of a roaring bitmap. The ids are split in containers of 2^16
+    ids by their high bits. Sparse containers store the sorted low 16 bits of their ids and dense containers store
+    them as 2^16 packed bits, so every container takes at most 8KB
+    Args:
+        size (int): The number of documents in the collection, the ids of the bitmap are in [0, size)
+        containers (dict): The containers for each high part of the ids
+    """
+    __slots__ = ('size', 'containers')
+
+    def __init__(self, size, containers=None):
+        self.size = size
+        self.containers = containers if containers is not None else {}
+
+    @classmethod
+    def from_sorted(cls, doc_ids, size):
+        """Creates a bitmap from a sorted array of document ids"""
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        high = doc_ids >> CONTAINER_BITS
+        splits = np.flatnonzero(np.diff(high)) + 1
+        containers = {}
+
+        for container_ids in np.split(doc_ids, splits) if len(doc_ids) else []:
+            low = (container_ids & (CONTAINER_SIZE - 1)).astype(np.uint16)
+            containers[int(container_ids[0] >> CONTAINER_BITS)] = optimise_container(low)
+        return cls(size, containers)
+
+    def to_array(self):
+        """The sorted document ids of the bitmap"""
+        parts = []
+        for key in sorted(self.containers):
+            container = self.containers[key]
+            low = bits_to_array(container) if is_bits(container) else container
+            parts.append((key << CONTAINER_BITS) + low.astype(np.int64))
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return sum(container_cardinality(container) for container in self.containers.values())
+
+    def __and__(self, other):
+        return self._combine(other, and_containers, set(self.containers) & set(other.containers))
+
+    def __or__(self, other):
+        containers = {}
+        for key in set(self.containers) | set(other.containers):
+            if key not in other.containers:
+                containers[key] = self.containers[key]
+            elif key not in self.containers:
+                containers[key] = other.containers[key]
+            else:
+                containers[key] = optimise_container(or_containers(self.containers[key], other.containers[key]))
+        return Bitmap(self.size, containers)
+
+    def __sub__(self, other):
+        containers = {}
+        for key, container in self.containers.items():
+            if key in other.containers:
+                container = optimise_container(andnot_containers(container, other.containers[key]))
+            if container is not None:
+                containers[key] = container
+        return Bitmap(self.size, containers)
+
+    def __invert__(self):
+        """The complement of the bitmap in the collection"""
+        containers = {}
+
+        for key in range(-(-self.size // CONTAINER_SIZE)):
+            if key in self.containers:
+                bits = ~to_bits(self.containers[key])
+            else:
+                bits = np.full(CONTAINER_SIZE // 64, np.iinfo(BITS_DTYPE).max, dtype=BITS_DTYPE)
+
+            # Clear the ids after the last document of the collection
+            clear_bits_from(bits, self.size - key * CONTAINER_SIZE)
+
+            container = optimise_container(bits)
+            if container is not None:
+                containers[key] = container
+        return Bitmap(self.size, containers)
+
+    def _combine(self, other, combine_containers, keys):
+        containers = {}
+        for key in keys:
+            container = optimise_container(combine_containers(self.containers[key], other.containers[key]))
+            if container is not None:
+                containers[key] = container
+        return Bitmap(self.size, containers)
@@ -0,0 +1,114 @@
+import mmap
+import numpy as np
+from index_storage import (vbyte_encode, vbyte_decode, delta_encode, smallest_uint_array, write_sections,
+                           read_sections)
+
+
+def build_biword_index(inverted_index, min_df=1):
+    """Finds the pairs of adjacent terms of the collection from the positions of the positional index. Every position
+    is tagged with its term and document and sorted in document order, so two consecutive positions of the same
+    document form a biword
+    Args:
+        inverted_index (PostingsIndex)
+        min_df (int): Only the pairs that appear in at least min_df documents are kept
+    Returns:
+        pairs (np.ndarray): The sorted keys of the pairs, first term id * number of terms + second term id
+        pair_offsets (np.ndarray): Where the documents of each pair start in `docs`, with their total number at the end
+        docs (np.ndarray): The sorted document ids of every pair
+    """
+    term_offsets, docs, tfs, positions = inverted_index.arrays()
+    n_terms = len(term_offsets) - 1
+
+    position_terms = np.repeat(np.repeat(np.arange(n_terms, dtype=np.int64), np.diff(term_offsets)), tfs)
+    position_docs = np.repeat(docs.astype(np.int64), tfs)
+    order = np.lexsort((positions, position_docs))
+    position_terms, position_docs, positions = position_terms[order], position_docs[order], positions[order]
+
+    adjacent = (position_docs[1:] == position_docs[:-1]) & (positions[1:] - positions[:-1] == 1)
+    pair_keys = position_terms[:-1][adjacent] * n_terms + position_terms[1:][adjacent]
+    pair_docs = position_docs[1:][adjacent]
+
+    # A pair can appear many times in a document, but is posted once
+    order = np.lexsort((pair_docs, pair_keys))
+    pair_keys, pair_docs = pair_keys[order], pair_docs[order]
+    first = np.ones(len(pair_keys), dtype=bool)
+    first[1:] = (pair_keys[1:] != pair_keys[:-1]) | (pair_docs[1:] != pair_docs[:-1])
+    pair_keys, pair_docs = pair_keys[first], pair_docs[first]
+
+    pairs, pair_starts, pair_dfs = np.unique(pair_keys, return_index=True, return_counts=True)
+    frequent = pair_dfs >= min_df
+    keep = np.repeat(frequent, pair_dfs)
+
+    pair_offsets = np.zeros(frequent.sum() + 1, dtype=np.int64)
+    np.cumsum(pair_dfs[frequent], out=pair_offsets[1:])
+    return pairs[frequent], pair_offsets, pair_docs[keep]
+
+
+def save_biword_index(inverted_index, file_name, min_df=1):
+    """Saves the biword index of a positional index next to its binary file. The document ids of every pair are delta
+    and variable-byte encoded like the postings of the positional index
+    Args:
+        inverted_index (PostingsIndex)
+        file_name (str)
+        min_df (int): Only the pairs that appear in at least min_df documents are saved, to bound the size of the file
+    """
+    pairs, pair_offsets, docs = build_biword_index(inverted_index, min_df)
+    encoded_docs, doc_bytes = vbyte_encode(delta_encode(docs, pair_offsets[:-1]))
+
+    write_sections(file_name + '.biword', {
+        'params': np.array([len(inverted_index), min_df], dtype=np.uint64),
+        'pairs': pairs.astype(np.uint64),
+        'doc_offsets': smallest_uint_array(np.concatenate(([0], np.cumsum(doc_bytes)))[pair_offsets]),
+        'docs': encoded_docs,
+    })
+    print('Biword index of {} pairs saved at {}.biword\n'.format(len(pairs), file_name))
+
+
+class BiwordIndex:
+    """Read-only biword index backed by a memory-mapped file saved by save_biword_index. It maps pairs of adjacent
+    stemmed terms to the documents they appear in, so two-word phrases are answered without their positions
+    Args:
+        file_name (str)
+        inverted_index (IndexReader): The positional index the biword index was built from, for the term ids
+    """
+
+    def __init__(self, file_name, inverted_index):
+        self._inverted_index = inverted_index
+        self._file = open(file_name + '.biword', 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        sections = read_sections(self._mmap)
+        self.n_terms, self.min_df = (int(param) for param in sections['params'])
+        self._pairs = sections['pairs']
+        self._doc_offsets = sections['doc_offsets']
+        self._docs = sections['docs']
+
+    def docs(self, term_1, term_2):
+        """The sorted ids of the documents where term_2 follows term_1
+        Args:
+            term_1 (str)
+            term_2 (str)
+        Returns:
+            (np.ndarray): The document ids, or None if the pair may have been left out by the frequency threshold
+        """
+        if term_1 not in self._inverted_index or term_2 not in self._inverted_index:
+            return np.zeros(0, dtype=np.int64)
+
+        key = self._inverted_index.term_id(term_1) * self.n_terms + self._inverted_index.term_id(term_2)
+        index = int(np.searchsorted(self._pairs, key))
+
+        if index < len(self._pairs) and self._pairs[index] == key:
+            return np.cumsum(vbyte_decode(self._docs[self._doc_offsets[index]:self._doc_offsets[index + 1]]))
+        # Missing pairs only prove that the phrase does not appear if every pair was kept
+        return np.zeros(0, dtype=np.int64) if self.min_df <= 1 else None
+
+    def close(self):
+        self._pairs = self._doc_offsets = self._docs = None
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,178 @@
+import mmap
+import os
+import zlib
+from collections import OrderedDict
+import numpy as np
+from index_storage import encode_strings, decode_strings, smallest_uint_array, write_sections, read_sections
+
+
+# Uncompressed size of a block of documents. Larger blocks compress better, smaller blocks are faster to fetch
+DOC_STORE_BLOCK_SIZE = 1 << 16
+
+
+class DocStoreWriter:
+    """Writes the text of the documents to a compressed document store while they are being indexed. The documents are
+    buffered until they reach block_size bytes and every block is compressed with zlib on its own, so a document can
+    be fetched by decompressing only its block. The compressed blocks are written to a temporary file as they are
+    filled, and the store is saved from it with the offset table of the blocks when the writer is closed
+    Args:
+        file_name (str)
+        block_size (int): The uncompressed size of a block in bytes, a document is never split between blocks
+    """
+
+    def __init__(self, file_name, block_size=DOC_STORE_BLOCK_SIZE):
+        self.file_name = file_name
+        self.block_size = block_size
+        self._doc_nums = []
+        self._doc_starts = []     # Where each document starts in its uncompressed block
+        self._block_docs = []     # The id of the first document of each block
+        self._block_lengths = []
+        self._blocks = open(file_name + '.docs.tmp', 'wb')
+        self._buffer = []
+        self._buffer_size = 0
+
+    def add(self, doc_no, text):
+        """Adds the next document to the store. Documents get dense ids in the order they are added"""
+        encoded = text.encode('utf-8')
+        if self._buffer and self._buffer_size + len(encoded) > self.block_size:
+            self._flush()
+        if not self._buffer:
+            self._block_docs.append(len(self._doc_nums))
+
+        self._doc_nums.append(doc_no)
+        self._doc_starts.append(self._buffer_size)
+        self._buffer.append(encoded)
+        self._buffer_size += len(encoded)
+
+    def _flush(self):
+        block = zlib.compress(b''.join(self._buffer))
+        self._blocks.write(block)
+        self._block_lengths.append(len(block))
+        self._buffer = []
+        self._buffer_size = 0
+
+    def close(self):
+        """Saves the store with all the documents added"""
+        if self._buffer:
+            self._flush()
+        self._blocks.close()
+
+        block_offsets = np.zeros(len(self._block_lengths) + 1, dtype=np.int64)
+        np.cumsum(self._block_lengths, out=block_offsets[1:])
+        # The blocks are memory-mapped, so they are copied from the temporary file without being read into memory
+        blocks = (np.memmap(self.file_name + '.docs.tmp', dtype=np.uint8, mode='r') if block_offsets[-1]
+                  else np.zeros(0, dtype=np.uint8))
+        write_sections(self.file_name + '.docs', {
+            'doc_nums': encode_strings(self._doc_nums),
+            'block_docs': np.array(self._block_docs + [len(self._doc_nums)], dtype=np.uint32),
+            'doc_starts': np.array(self._doc_starts, dtype=np.uint32),
+            'block_offsets': smallest_uint_array(block_offsets),
+            'blocks': blocks,
+        })
+        del blocks
+        os.remove(self.file_name + '.docs.tmp')
+        print('Document store of {} blocks saved at {}.docs\n'.format(len(self._block_lengths), self.file_name))
+
+    def discard(self):
+        """Removes the temporary file without saving the store, e.g. when not all the documents were read"""
+        self._blocks.close()
+        os.remove(self.file_name + '.docs.tmp')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        # A store missing some of the documents is never saved
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def store_documents(docs, file_name, block_size=DOC_STORE_BLOCK_SIZE):
+    """Passes the documents through to the indexing while adding them to a document store, which is saved once all
+    the documents have been read. If the indexing fails or stops before the last document, the store is not saved
+    Args:
+        docs (iterable): (document number, headline with text) pairs
+        file_name (str)
+        block_size (int)
+    Yields:
+        (tuple): The same (document number, headline with text) pairs
+    """
+    writer = DocStoreWriter(file_name, block_size)
+    try:
+        for doc_no, text in docs:
+            writer.add(doc_no, text)
+            yield doc_no, text
+    except BaseException:
+        # Also raised as GeneratorExit when the generator is closed before all the documents were read
+        writer.discard()
+        raise
+    else:
+        writer.close()
+
+
+class DocStore:
+    """Read-only document store backed by a memory-mapped file saved by DocStoreWriter. The text of a document is
+    fetched by decompressing its block, and the most recently used blocks are kept decompressed in an LRU cache
+    Args:
+        file_name (str)
+        cache_size (int): The maximum number of blocks kept decompressed
+    """
+
+    def __init__(self, file_name, cache_size=16):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._file = open(file_name + '.docs', 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        sections = read_sections(self._mmap)
+        self.doc_nums = decode_strings(sections['doc_nums'])
+        self._doc_ids = {doc_no: doc_id for doc_id, doc_no in enumerate(self.doc_nums)}
+        self._block_docs = sections['block_docs']
+        self._doc_starts = sections['doc_starts']
+        self._block_offsets = sections['block_offsets']
+        self._blocks = sections['blocks']
+
+    def __len__(self):
+        return len(self.doc_nums)
+
+    def doc_id(self, doc_no):
+        """The id of a document from its DOCNO"""
+        return self._doc_ids[doc_no]
+
+    def text(self, doc_id):
+        """The headline and text of a document, as they were indexed
+        Args:
+            doc_id (int)
+        Returns:
+            (str)
+        """
+        block = int(np.searchsorted(self._block_docs, doc_id, side='right')) - 1
+        block_text = self._block(block)
+        start = int(self._doc_starts[doc_id])
+        end = int(self._doc_starts[doc_id + 1]) if doc_id + 1 < self._block_docs[block + 1] else len(block_text)
+        return block_text[start:end].decode('utf-8')
+
+    def _block(self, block):
+        if block in self._cache:
+            self._cache.move_to_end(block)
+            return self._cache[block]
+
+        block_text = zlib.decompress(self._blocks[self._block_offsets[block]:self._block_offsets[block + 1]])
+        self._cache[block] = block_text
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return block_text
+
+    def close(self):
+        self._cache.clear()
+        self._block_docs = self._doc_starts = self._block_offsets = self._blocks = None
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,130 @@
+import mmap
+import numpy as np
+from index_storage import smallest_uint_array, write_sections, read_sections
+
+
+def build_forward_index(inverted_index):
+    """Inverts the postings of the positional index into the term vector of every document. The postings are sorted
+    by document, keeping the term order of the index, so the terms of each document are sorted by term id
+    Args:
+        inverted_index (PostingsIndex)
+    Returns:
+        doc_offsets (np.ndarray): Where the terms of each document start, with the total number of entries at the end
+        term_ids (np.ndarray): The sorted term ids of every document
+        counts (np.ndarray): How many times each term appears in the document
+    """
+    term_offsets, docs, tfs = inverted_index.doc_arrays()
+    posting_terms = np.repeat(np.arange(len(term_offsets) - 1), np.diff(term_offsets))
+    order = np.argsort(docs, kind='stable')
+
+    doc_offsets = np.zeros(len(inverted_index.doc_nums) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(docs, minlength=len(inverted_index.doc_nums)), out=doc_offsets[1:])
+    return doc_offsets, posting_terms[order], tfs[order]
+
+
+def save_forward_index(inverted_index, file_name, token_offsets=None):
+    """Saves the forward index of a positional index next to its binary file. The term ids and counts are stored in
+    flat arrays, uncompressed, so the term vector of a document is a slice of the memory-mapped file
+    Args:
+        inverted_index (PostingsIndex)
+        file_name (str)
+        token_offsets (list): If given, the (start, end) character offsets of the token at every position of each
+            document, which are saved in the order of the positions
+    """
+    doc_offsets, term_ids, counts = build_forward_index(inverted_index)
+
+    sections = {
+        'doc_offsets': smallest_uint_array(doc_offsets),
+        'term_ids': term_ids.astype(np.uint32),
+        # Most term frequencies are small, so 16 bits are enough unless a term repeats more than 65535 times
+        'counts': counts.astype(np.uint16 if len(counts) == 0 or counts.max() < 2 ** 16 else np.uint32),
+        'doc_lengths': inverted_index.doc_lengths.astype(np.uint32),
+    }
+    if token_offsets is not None:
+        offsets = np.concatenate(token_offsets) if token_offsets else np.zeros((0, 2), dtype=np.int64)
+        if len(offsets) != inverted_index.doc_lengths.sum():
+            raise ValueError('The token offsets do not match the positions of the index')
+        sections['token_starts'] = offsets[:, 0].astype(np.uint32)
+        sections['token_ends'] = offsets[:, 1].astype(np.uint32)
+
+    write_sections(file_name + '.fwd', sections)
+    print('Forward index saved at {}.fwd\n'.format(file_name))
+
+
+class ForwardIndex:
+    """Read-only forward index backed by a memory-mapped file saved by save_forward_index. It maps every document id to
+    the ids of its terms, as given by the term_id of the positional index, and their counts. When the token offsets
+    were saved, it also maps the positions of a document to the characters of its text
+    Args:
+        file_name (str)
+    """
+
+    def __init__(self, file_name):
+        self._file = open(file_name + '.fwd', 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        sections = read_sections(self._mmap)
+        self._doc_offsets = sections['doc_offsets']
+        self._term_ids = sections['term_ids']
+        self._counts = sections['counts']
+        # The number of terms of each document, after removing the stop words
+        self.doc_lengths = sections['doc_lengths']
+        self.avg_doc_length = float(self.doc_lengths.mean()) if len(self.doc_lengths) else 0.0
+        self._token_starts = sections.get('token_starts')
+        self._token_ends = sections.get('token_ends')
+        # The tokens of every document start after the tokens of the previous documents
+        self._first_tokens = np.cumsum(self.doc_lengths, dtype=np.int64) - self.doc_lengths
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def term_vector(self, doc_id):
+        """The term vector of a document
+        Args:
+            doc_id (int)
+        Returns:
+            term_ids (np.ndarray): The sorted ids of the terms of the document
+            counts (np.ndarray): How many times each term appears in the document
+        """
+        start, end = self._doc_offsets[doc_id], self._doc_offsets[doc_id + 1]
+        return self._term_ids[start:end], self._counts[start:end]
+
+    def term_counts(self, doc_ids, n_terms):
+        """Sums the term vectors of some documents, e.g. the top documents of a query for pseudo relevance feedback
+        Args:
+            doc_ids (np.ndarray)
+            n_terms (int): The number of terms of the index
+        Returns:
+            (np.ndarray): How many times every term appears in the documents
+        """
+        starts = self._doc_offsets[doc_ids].astype(np.int64)
+        lengths = self._doc_offsets[np.asarray(doc_ids) + 1].astype(np.int64) - starts
+        entries = np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        return np.bincount(self._term_ids[entries], weights=self._counts[entries], minlength=n_terms).astype(np.int64)
+
+    def token_offsets(self, doc_id, positions):
+        """Finds where the tokens at some positions of a document are in its text
+        Args:
+            doc_id (int)
+            positions (np.ndarray): Positions of the document, starting from 1 like the positions of the postings
+        Returns:
+            starts (np.ndarray): The character offset of the start of each token
+            ends (np.ndarray): The character offset after the end of each token
+        """
+        if self._token_starts is None:
+            raise ValueError('The forward index was saved without token offsets')
+
+        tokens = self._first_tokens[doc_id] + np.asarray(positions, dtype=np.int64) - 1
+        return self._token_starts[tokens], self._token_ends[tokens]
+
+    def close(self):
+        self._doc_offsets = self._term_ids = self._counts = self.doc_lengths = None
+        self._token_starts = self._token_ends = self._first_tokens = None
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,114 @@
+import mmap
+import numpy as np
+from index_storage import (vbyte_encode, vbyte_decode, delta_encode, smallest_uint_array, write_sections,
+                           read_sections)
+
+
+IMPACT_LEVELS = 255
+
+
+def build_impact_index(inverted_index):
+    """Sorts the postings of every term by decreasing TFIDF weight, quantized to 8 bit impacts. The weights are divided
+    by the highest weight of the index and rounded to one of IMPACT_LEVELS levels, so they share a single scale. The
+    postings of a term with the same impact form a segment, where the documents are sorted by id
+    Args:
+        inverted_index (PostingsIndex)
+    Returns:
+        scale (float): The weight of an impact of 1
+        segment_offsets (np.ndarray): Where the segments of each term start, with the total number of segments at the
+            end. The segments of a term are sorted by decreasing impact
+        segment_impacts (np.ndarray): The impact of every segment
+        segment_starts (np.ndarray): Where the documents of each segment start in `docs`, with their total at the end
+        docs (np.ndarray): The document ids of all segments
+    """
+    term_offsets, docs, tfs = inverted_index.doc_arrays()
+    dfs = np.diff(term_offsets)
+    weights = (1 + np.log10(tfs)) * np.repeat(np.log10(len(inverted_index.doc_nums) / dfs), dfs)
+
+    scale = weights.max() / IMPACT_LEVELS if len(weights) and weights.max() > 0 else 1.0
+    impacts = np.round(weights / scale).astype(np.int64)
+    # A document with a positive weight keeps at least the lowest impact, so it is not lost by the quantization
+    impacts[(impacts == 0) & (weights > 0)] = 1
+
+    # Sort the postings of every term by decreasing impact and then by document id
+    posting_terms = np.repeat(np.arange(len(dfs)), dfs)
+    order = np.lexsort((docs, -impacts, posting_terms))
+    posting_terms, impacts, docs = posting_terms[order], impacts[order], docs[order]
+
+    new_segment = np.ones(len(docs), dtype=bool)
+    new_segment[1:] = (posting_terms[1:] != posting_terms[:-1]) | (impacts[1:] != impacts[:-1])
+    segment_starts = np.append(np.flatnonzero(new_segment), len(docs))
+
+    segment_offsets = np.zeros(len(dfs) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(posting_terms[new_segment], minlength=len(dfs)), out=segment_offsets[1:])
+    return scale, segment_offsets, impacts[new_segment], segment_starts, docs
+
+
+def save_impact_index(inverted_index, file_name):
+    """Saves the impact-ordered postings of a positional index next to its binary file. The documents of every segment
+    are delta and variable-byte encoded like the postings of the positional index
+    Args:
+        inverted_index (PostingsIndex)
+        file_name (str)
+    """
+    scale, segment_offsets, segment_impacts, segment_starts, docs = build_impact_index(inverted_index)
+    encoded_docs, doc_bytes = vbyte_encode(delta_encode(docs, segment_starts[:-1]))
+
+    write_sections(file_name + '.impact', {
+        'scale': np.array([scale], dtype=np.float64),
+        'segment_offsets': smallest_uint_array(segment_offsets),
+        'segment_impacts': segment_impacts.astype(np.uint8),
+        'doc_offsets': smallest_uint_array(np.concatenate(([0], np.cumsum(doc_bytes)))[segment_starts]),
+        'docs': encoded_docs,
+    })
+    print('Impact-ordered index saved at {}.impact\n'.format(file_name))
+
+
+class ImpactIndex:
+    """Read-only impact-ordered index backed by a memory-mapped file saved by save_impact_index. The documents of a
+    segment are only decoded when the segment is scored
+    Args:
+        file_name (str)
+        inverted_index (IndexReader): The positional index the impact index was built from, for the term ids
+    """
+
+    def __init__(self, file_name, inverted_index):
+        self._inverted_index = inverted_index
+        self._file = open(file_name + '.impact', 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        sections = read_sections(self._mmap)
+        self.scale = float(sections['scale'][0])
+        self._segment_offsets = sections['segment_offsets']
+        self._segment_impacts = sections['segment_impacts']
+        self._doc_offsets = sections['doc_offsets']
+        self._docs = sections['docs']
+
+    def segments(self, term):
+        """The segments of a term, sorted by decreasing impact
+        Args:
+            term (str)
+        Returns:
+            (list): The (impact, segment id) of every segment, empty if the term is not in the index
+        """
+        if term not in self._inverted_index:
+            return []
+
+        term_id = self._inverted_index.term_id(term)
+        start, end = int(self._segment_offsets[term_id]), int(self._segment_offsets[term_id + 1])
+        return list(zip(self._segment_impacts[start:end].tolist(), range(start, end)))
+
+    def segment_docs(self, segment_id):
+        """The sorted document ids of a segment"""
+        return np.cumsum(vbyte_decode(self._docs[self._doc_offsets[segment_id]:self._doc_offsets[segment_id + 1]]))
+
+    def close(self):
+        self._segment_offsets = self._segment_impacts = self._doc_offsets = self._docs = None
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,261 +1,813 @@
-import re
+import abc
+import heapq
+from collections import deque, Counter
 import numpy as np
+from scipy.sparse import csr_matrix
 from preprocess import stemming
+from bitmap import Bitmap
+from postings import intersect_sorted, union_sorted, difference_sorted
+from query_parser import parse_query
 
 
-PHRASE_REGEX = re.compile(r'\"\w+(\s+)\w+\"')
-PROXIMITY_REGEX = re.compile(r'\#\d+\(.\w+\,(\s+).\w+\)')
+# Relative margin when comparing scores with sums of upper bounds, since they add the same weights in different orders
+SCORE_TOLERANCE = 1e-9
 
 
 def create_term_doc_collection(inverted_index, doc_nums):
     """Create a term-document incident collection that shows which documents each term belongs to
     Args:
-        inverted_index (dict): Index of terms as keys and dict of documents with positions as values
-        doc_nums (list): An array of the documents numbers
+        inverted_index (dict): Index of terms as keys and their Postings as values
+        doc_nums (list): The document number of each document id
     Returns:
-        collection_dict (dict): A boolean vector for each word
+        collection_dict (dict): A compressed bitmap of the documents of each word
     """
-    words = list(inverted_index.keys())
     collection_dict = dict()
-    boolean_matrix = np.zeros((len(words), len(doc_nums)), dtype=np.bool)
 
-    # Create a mapping of document numbers to continuous indices from 0 to len(doc_nums)-1
-    doc_num_dict = {}
-    for ind, doc_num in enumerate(doc_nums):
-        doc_num_dict[doc_num] = ind
-
-    for i, word in enumerate(words):
-        docs_for_specific_word = list(inverted_index[word].keys())
-
-        for index, doc_num in enumerate(docs_for_specific_word):
-            doc_id = doc_num_dict[doc_num]
-            boolean_matrix[i][int(doc_id)] = True
-
-        collection_dict[word] = boolean_matrix[i]
+    for word in inverted_index.keys():
+        collection_dict[word] = Bitmap.from_sorted(inverted_index[word].docs, len(doc_nums))
 
     return collection_dict
 
 
-def phrase_proximity_search(terms, max_distance, keep_order, inverted_index, doc_nums):
-    """Common function for phrase and proximity search. We treat the phrase search as a proximity search with distance 1
+def phrase_match(term_positions, max_distance):
+    """Checks if the words of a phrase appear in order in a document, with every word at most max_distance positions
+    after the previous one. The positions where a partial phrase can end are joined with the positions of the next
+    word with two pointers, so the cost is linear in the number of positions, and the join stops as soon as the
+    partial phrase has no matches left
     Args:
-        terms (list): Description
-        max_distance (int): The distance of the words indicated by the number after the # in the query
-        keep_order (boolean): If True, it's a phrase search (where order matters) otherwise it's a proximity search
-        inverted_index (dict)
-        doc_nums (list)
+        term_positions (list): The sorted positions of each word of the phrase in the document, in phrase order
+        max_distance (int)
     Returns:
-        boolean_vector (list): A list of True and False for each document
+        (boolean): True if the phrase appears in the document
     """
-    term_1_docs = inverted_index[terms[0]]
-    term_2_docs = inverted_index[terms[1]]
+    phrase_ends = term_positions[0]
 
-    # Find common docs between the 2 words
-    common_docs = set(term_1_docs).intersection(term_2_docs)
-    common_docs_ids = []
+    for positions in term_positions[1:]:
+        next_ends = []
+        index = 0
 
-    for doc in list(common_docs):
-        # Check the distance between the words
-        for i in term_2_docs[doc]:
-            for j in term_1_docs[doc]:
-                distance_diff = int(i) - int(j)
-
-                if keep_order:
-                    # Order of words matters in phrase search so distance diff MUST be positive
-                    if distance_diff > 0 and distance_diff <= max_distance:
-                        common_docs_ids.append(int(doc))
-                else:
-                    # Order of words does not matter in proximity search and distance diff can be negative,
-                    # so we take its absolute value
-                    if abs(distance_diff) <= max_distance:
-                        common_docs_ids.append(int(doc))
-
-    common_docs_ids = sorted(set([int(i) for i in common_docs_ids]))
-    boolean_vector = convert_doc_ids_to_boolean(common_docs_ids, doc_nums)
-    return boolean_vector
-
-
-def convert_doc_ids_to_boolean(doc_list, doc_nums):
-    """Converts a list of document ids into a list of boolean values for each document, which indicates the existance
-    of a search result in each dicument
-    Args:
-        doc_list (list)
-        doc_nums (list)
-    Returns:
-        boolean_doc_list (list)
-    """
-    boolean_doc_list = np.zeros(len(doc_nums), dtype=np.bool)
+        for position in positions:
+            # Skip the partial phrases that end too far before the word
+            while index < len(phrase_ends) and position - phrase_ends[index] > max_distance:
+                index += 1
+            # Order of words matters in phrase search so the distance MUST be positive
+            if index < len(phrase_ends) and phrase_ends[index] < position:
+                next_ends.append(position)
 
-    for doc_id in doc_list:
-        doc_index = doc_nums.index(str(doc_id))
-        boolean_doc_list[doc_index] = True
+        if not next_ends:
+            return False
+        phrase_ends = next_ends
 
-    return boolean_doc_list
+    return True
 
 
-def convert_booleans_to_docs_ids(bool_list, doc_nums):
-    """The opposite of the function convert_doc_ids_to_boolean. It converts a list of boolean values to a list of document ids
+def window_match(term_positions, max_distance):
+    """Checks if all the words appear in any order in a window of max_distance positions of a document. The positions
+    of all words are merged and a sliding window over them keeps how many positions of each word it holds, so the
+    cost is linear in the number of positions and the search stops at the first window that has every word
+    Args:
+        term_positions (list): The sorted positions of each word in the document
+        max_distance (int)
+    Returns:
+        (boolean): True if a window contains all the words
+    """
+    n_terms = len(term_positions)
+    window = deque()
+    counts = [0] * n_terms
+    covered_terms = 0
+
+    tagged_positions = ([(position, term) for position in positions] for term, positions in enumerate(term_positions))
+    for position, term in heapq.merge(*tagged_positions):
+        window.append((position, term))
+        counts[term] += 1
+        if counts[term] == 1:
+            covered_terms += 1
+
+        # Shrink the window from the left while it still has every word
+        while covered_terms == n_terms:
+            first_position, first_term = window[0]
+            if position - first_position <= max_distance:
+                return True
+            window.popleft()
+            counts[first_term] -= 1
+            if counts[first_term] == 0:
+                covered_terms -= 1
+
+    return False
+
+
+def phrase_proximity_search(terms, max_distance, keep_order, inverted_index, doc_nums, biword_index=None):
+    """Common function for phrase and proximity search of any number of words. We treat the phrase search as a
+    proximity search with distance 1. When a biword index is given, two-word phrases are answered from it directly and
+    the documents of the pairs of longer phrases are used to filter the documents before checking their positions
     Args:
-        bool_list (list)
-        doc_nums (list)
+        terms (list): The words of the phrase or proximity search
+        max_distance (int): The distance of the words indicated by the number after the # in the query
+        keep_order (boolean): If True, it's a phrase search (where order matters) otherwise it's a proximity search
+        inverted_index (dict)
+        doc_nums (list): The document number of each document id
+        biword_index (BiwordIndex): Optional index of the documents of adjacent pairs of words
     Returns:
-        doc_id_list (list)
+        (np.ndarray): The sorted ids of the documents that match the search
     """
-    doc_id_list = []
+    if not terms or not all(term in inverted_index for term in terms):
+        return np.zeros(0, dtype=np.int64)
+
+    docs_lists = []
+    if keep_order and max_distance == 1 and biword_index is not None:
+        # Pairs left out of the biword index by its frequency threshold are None
+        pairs_docs = [biword_index.docs(term_1, term_2) for term_1, term_2 in zip(terms, terms[1:])]
+        if len(terms) == 2 and pairs_docs[0] is not None:
+            return pairs_docs[0].astype(np.int64)
+        docs_lists = [pair_docs for pair_docs in pairs_docs if pair_docs is not None]
+
+    # Find the docs that contain every indexed pair and every word, starting from the rarest ones. The postings of the
+    # other words are only read for the common docs found so far: with their skip lists, only the blocks that can
+    # hold those docs are decoded, along with the positions in the docs that contain the word
+    terms_by_df = sorted(set(terms), key=inverted_index.df)
+    term_postings = {}
+    if not docs_lists:
+        rarest_term = terms_by_df.pop(0)
+        term_postings[rarest_term] = inverted_index[rarest_term]
+        docs_lists = [term_postings[rarest_term].docs]
+
+    common_docs = None
+    for docs in sorted(docs_lists, key=len):
+        common_docs = docs if common_docs is None else intersect_sorted(common_docs, docs)
+
+    for term in terms_by_df:
+        if len(common_docs) == 0:
+            return np.zeros(0, dtype=np.int64)
+        term_postings[term], _ = inverted_index.intersect_postings(term, common_docs)
+        common_docs = term_postings[term].docs
+
+    if len(terms) == 1 or len(common_docs) == 0:
+        return common_docs.astype(np.int64)
+
+    # The index of every common doc in the postings read for each word
+    term_postings = [term_postings[term] for term in terms]
+    term_indices = [np.searchsorted(postings.docs, common_docs).tolist() for postings in term_postings]
+    common_docs_ids = []
+
+    for doc_index, doc in enumerate(common_docs.tolist()):
+        term_positions = [postings.positions_at(indices[doc_index]).tolist()
+                          for postings, indices in zip(term_postings, term_indices)]
+
+        if keep_order:
+            match = phrase_match(term_positions, max_distance)
+        else:
+            match = window_match(term_positions, max_distance)
+
+        if match:
+            common_docs_ids.append(doc)
 
-    for index, boolean_val in enumerate(bool_list):
-        if boolean_val is True:
-            doc_id = doc_nums[index]
-            doc_id_list.append(doc_id)
-    return doc_id_list
+    return np.array(common_docs_ids, dtype=np.int64)
 
 
-def boolean_search(query_str_transformed, doc_nums):
-    """Performs boolean search for one or more combinations of terms.
+def evaluate_query(node, collection_table, inverted_index, doc_nums, biword_index=None):
+    """Evaluates the syntax tree of a boolean query directly on the bitmaps of the terms
     Args:
-        query_str_transformed (str): A string representation of the AND, OR and NOT used between numpy arrays
-        doc_nums (list)
+        node (tuple): A node of the syntax tree built by parse_query
+        collection_table (dict)
+        inverted_index (dict)
+        doc_nums (list): The document number of each document id
+        biword_index (BiwordIndex): Optional biword index for phrase search
     Returns:
-        documents (list): The resulting documents of the boolean search
+        (Bitmap): The documents that match the node
     """
-    doc_num_mapping = {}  # Map doc numbers to continuous indices
+    node_type = node[0]
 
-    for ind, doc_num in enumerate(doc_nums):
-        doc_num_mapping[ind] = doc_num
+    if node_type == 'or':
+        return (evaluate_query(node[1], collection_table, inverted_index, doc_nums, biword_index) |
+                evaluate_query(node[2], collection_table, inverted_index, doc_nums, biword_index))
 
-    # Use eval to evaluate the boolean search
-    boolean_vector = eval(query_str_transformed)
-    documents = [doc_num_mapping[i] for i in range(len(boolean_vector)) if boolean_vector[i] == True]
-    return documents
+    elif node_type == 'and':
+        return (evaluate_query(node[1], collection_table, inverted_index, doc_nums, biword_index) &
+                evaluate_query(node[2], collection_table, inverted_index, doc_nums, biword_index))
 
+    elif node_type == 'not':
+        return ~evaluate_query(node[1], collection_table, inverted_index, doc_nums, biword_index)
 
-def split_query(query):
-    def replace_space_with_underscore(match):
-        return match.group(0).replace(' ', '_')
+    elif node_type == 'proximity':
+        doc_ids = phrase_proximity_search(stemming(node[2]), node[1], False, inverted_index, doc_nums)
+        return Bitmap.from_sorted(doc_ids, len(doc_nums))
 
-    def remove_space_from_proximity_search(match):
-        return match.group(0).replace(' ', '')
+    elif node_type == 'phrase':  # We treat phrase search as a proximity search with distance 1
+        doc_ids = phrase_proximity_search(stemming(node[1]), 1, True, inverted_index, doc_nums, biword_index)
+        return Bitmap.from_sorted(doc_ids, len(doc_nums))
 
-    # Replaces spaces from inside quotes with underscore
-    query = PHRASE_REGEX.sub(replace_space_with_underscore, query)
-    # Removes space from the proximity search
-    query = PROXIMITY_REGEX.sub(remove_space_from_proximity_search, query)
+    stem_word = stemming([node[1]])[0]
+    if stem_word in collection_table:
+        return collection_table[stem_word]
+    return Bitmap(len(doc_nums))
 
-    # @TODO: Remove stop words if not a logical operator
-    return query.lower().split()
 
+def flatten_query(node, node_type):
+    """Collects the operands of nested nodes of the same type, e.g. the operands of a AND (b AND c) are a, b and c"""
+    if node[0] != node_type:
+        return [node]
+    return flatten_query(node[1], node_type) + flatten_query(node[2], node_type)
 
-def array_to_string(arr):
-    array_str = ''
 
-    for i in arr:
-        array_str += '{}, '.format(i)
-    return array_str
+def estimate_query_cost(node, inverted_index, n_docs):
+    """Estimates the number of documents that match a node of a query from the document frequencies of the term
+    dictionary, without decoding any postings
+    Args:
+        node (tuple): A node of the syntax tree built by parse_query
+        inverted_index (dict)
+        n_docs (int): The number of documents in the collection
+    Returns:
+        (int): An upper bound of the number of matching documents
+    """
+    node_type = node[0]
+
+    if node_type == 'or':
+        return min(n_docs, sum(estimate_query_cost(operand, inverted_index, n_docs) for operand in node[1:]))
+    elif node_type == 'and':
+        return min(estimate_query_cost(operand, inverted_index, n_docs) for operand in node[1:])
+    elif node_type == 'not':
+        return n_docs
+    elif node_type == 'term':
+        terms = stemming([node[1]])
+    else:
+        terms = stemming(node[-1])
+
+    # An empty phrase does not match any document
+    return min((inverted_index.df(term) if term in inverted_index else 0 for term in terms), default=0)
+
+
+def term_docs_in(word, doc_ids, inverted_index):
+    """The documents of a sorted array that contain a query word. Only the blocks of the postings of the word that can
+    hold the documents are searched, using the skip list of the postings
+    Args:
+        word (str): A word of the query, before stemming
+        doc_ids (np.ndarray): Sorted document ids
+        inverted_index (IndexReader)
+    Returns:
+        (np.ndarray): The sorted document ids that contain the word
+    """
+    stem_word = stemming([word])[0]
+    if stem_word not in inverted_index:
+        return doc_ids[:0]
+    return inverted_index.intersect_docs(stem_word, doc_ids)
 
 
-def boolean_search_queries(queries, collection_table, inverted_index, doc_nums):
+def merge_query(node, inverted_index, doc_nums, biword_index=None):
+    """Evaluates the syntax tree of a boolean query by merging the sorted postings lists of its terms. The operands of
+    an AND are intersected in ascending order of their estimated document frequency, so the cost follows the shortest
+    postings list and the evaluation stops as soon as the intersection is empty. NOT operands of an AND are subtracted
+    from the intersection instead of being complemented
+    Args:
+        node (tuple): A node of the syntax tree built by parse_query
+        inverted_index (dict)
+        doc_nums (list): The document number of each document id
+        biword_index (BiwordIndex): Optional biword index for phrase search
+    Returns:
+        (np.ndarray): The sorted ids of the documents that match the node
+    """
+    node_type = node[0]
+
+    if node_type == 'or':
+        doc_ids = np.zeros(0, dtype=np.int64)
+        for operand in flatten_query(node, 'or'):
+            doc_ids = union_sorted(doc_ids, merge_query(operand, inverted_index, doc_nums, biword_index))
+        return doc_ids
+
+    elif node_type == 'and':
+        operands = flatten_query(node, 'and')
+        included = [operand for operand in operands if operand[0] != 'not']
+        excluded = [operand[1] for operand in operands if operand[0] == 'not']
+
+        if included:
+            included.sort(key=lambda operand: estimate_query_cost(operand, inverted_index, len(doc_nums)))
+            doc_ids = merge_query(included[0], inverted_index, doc_nums, biword_index)
+        else:  # Only negated operands, e.g. NOT a AND NOT b
+            doc_ids = np.arange(len(doc_nums))
+
+        for operand in included[1:]:
+            if len(doc_ids) == 0:
+                break
+            if operand[0] == 'term':
+                doc_ids = term_docs_in(operand[1], doc_ids, inverted_index)
+            else:
+                doc_ids = intersect_sorted(doc_ids, merge_query(operand, inverted_index, doc_nums, biword_index))
+
+        for operand in excluded:
+            if len(doc_ids) == 0:
+                break
+            if operand[0] == 'term':
+                doc_ids = difference_sorted(doc_ids, term_docs_in(operand[1], doc_ids, inverted_index))
+            else:
+                doc_ids = difference_sorted(doc_ids, merge_query(operand, inverted_index, doc_nums, biword_index))
+        return doc_ids
+
+    elif node_type == 'not':
+        doc_ids = merge_query(node[1], inverted_index, doc_nums, biword_index)
+        return difference_sorted(np.arange(len(doc_nums)), doc_ids)
+
+    elif node_type == 'proximity':
+        return phrase_proximity_search(stemming(node[2]), node[1], False, inverted_index, doc_nums)
+
+    elif node_type == 'phrase':  # We treat phrase search as a proximity search with distance 1
+        return phrase_proximity_search(stemming(node[1]), 1, True, inverted_index, doc_nums, biword_index)
+
+    stem_word = stemming([node[1]])[0]
+    if stem_word in inverted_index:
+        return inverted_index[stem_word].docs
+    return np.zeros(0, dtype=np.int64)
+
+
+def boolean_search_queries(queries, collection_table, inverted_index, doc_nums, biword_index=None):
     """Performs boolean, phrase or proximity search for a given set of queries
     Args:
         queries (list): Preprocessed queries
-        collection_table (dict)
+        collection_table (dict): The bitmaps of the terms from create_term_doc_collection, to evaluate the queries on
+            the bitmaps. If None, the queries are evaluated by merging the postings lists of their terms instead
         inverted_index (dict)
-        doc_nums (list)
+        doc_nums (list): The document number of each document id
+        biword_index (BiwordIndex): Optional biword index for phrase search
     Returns:
-        search_results (list): The resultsing documents for each search query
+        search_results (list): The ids of the resulting documents for each search query
     """
     print('Starting boolean search...')
-    logical_operators_mapping = {'and': '&', 'or': '|', 'not': '~'}
     search_results = []
 
     for query in queries:
-        query_tokens = split_query(query)
-        query_eval_string = ''
-
-        for token in query_tokens:
-            if token.startswith('#'):  # Proximity search
-                # Split phrase into distance and terms
-                distance, term_1, term_2 = list(filter(None, re.split(r'\W+', token)))
-                terms = stemming([term_1, term_2])
-                boolean_vector = phrase_proximity_search(terms, int(distance), False, inverted_index, doc_nums)
-                query_eval_string += 'np.array([{}]) '.format(array_to_string(boolean_vector))
-
-            elif token.startswith('"'):  # Phrase search - we treat it as phrase search with distance 1
-                terms = stemming(token.replace('_', ' ').replace('"', '').split())
-                boolean_vector = phrase_proximity_search(terms, 1, True, inverted_index, doc_nums)
-                query_eval_string += 'np.array([{}]) '.format(array_to_string(boolean_vector))
-
-            elif token in logical_operators_mapping:    # One of AND, OR, NOT -> boolean search
-                token = logical_operators_mapping[token]
-                query_eval_string += '{} '.format(token)
-
-            else:  # Query contains a combination of queries
-                stem_word = stemming([token])[0]
-                boolean_vector = collection_table[stem_word]
-                query_eval_string += 'np.array([{}]) '.format(array_to_string(boolean_vector))
-
-        query_search_results = boolean_search(query_eval_string, doc_nums)
-        search_results.append(query_search_results)
+        if collection_table is None:
+            doc_ids = merge_query(parse_query(query), inverted_index, doc_nums, biword_index)
+        else:
+            doc_ids = evaluate_query(parse_query(query), collection_table, inverted_index, doc_nums,
+                                     biword_index).to_array()
+        search_results.append(doc_ids.tolist())
 
     return search_results
 
 
-def save_boolean_search_results(queries, results_boolean, file_name):
+def save_boolean_search_results(queries, results_boolean, doc_nums, file_name):
     """Saves the results for the boolean search queries in the provided file_name
     Args:
         queries (list): Queries from queries.boolean.txt
         results_boolean (list)
+        doc_nums (list): The document number of each document id
         file_name (str): queries.boolean.txt
     """
     f = open(file_name + '.txt', 'w+')
 
     for index, query in enumerate(queries):
         for doc_id in results_boolean[index]:
-            f.write(str(index + 1) + ' 0 ' + doc_id + ' 0 1 0\n')
+            f.write(str(index + 1) + ' 0 ' + doc_nums[doc_id] + ' 0 1 0\n')
     f.close()
     print('Boolean search results saved at {}.txt\n'.format(file_name))
 
 
-def ranked_retrieval(queries, collection_table, doc_nums, inverted_index, stop_words):
+def ranked_retrieval(queries, doc_nums, inverted_index, stop_words, mode='exhaustive', top_k=1000, impact_index=None,
+                     max_postings=None, scorer=None):
     """Performs ranked IR based on TFIDF
     Args:
         queries (list): Queries from queries.ranked.txt
-        collection_table (dict)
-        doc_nums (list)
+        doc_nums (list): The document number of each document id
         inverted_index (dict)
         stop_words (list)
+        mode (str): How the documents are scored:
+            'exhaustive' scores every document that contains a query term with TFIDF
+            'taat' scores the queries a term at a time with rank_query
+            'maxscore' skips the documents that cannot enter the top_k with maxscore_rank_query
+            'impact' scores the quantized impact-ordered postings with impact_rank_query
+            'cosine' ranks by the cosine similarity of the TFIDF vectors with cosine_rank_query
+        top_k (int): The number of documents kept for each query, in all modes except 'exhaustive'
+        impact_index (ImpactIndex): The impact-ordered postings, for the 'impact' mode
+        max_postings (int): The number of postings after which the 'impact' mode stops, None for all of them
+        scorer (Scorer): The ranking function of the 'taat' mode, e.g. BM25Scorer or DirichletScorer. TFIDF if None
     Returns:
-        ranked_scores (list): The resultsing documents and the score for each ranked query
+        ranked_scores (list): The resultsing document ids and the score for each ranked query
     """
     print('Starting ranked retrieval...')
     ranked_scores = {}
+    skipped_postings, query_postings = 0, 0
+
+    for query_index, query_tokens in enumerate(queries):
+        if mode == 'exhaustive':
+            query_scores = exhaustive_rank_query(query_tokens, inverted_index, len(doc_nums))
+        elif mode == 'taat':
+            query_scores = rank_query(query_tokens, inverted_index, len(doc_nums), top_k, scorer)
+        elif mode == 'maxscore':
+            query_scores, n_skipped, n_postings = maxscore_rank_query(query_tokens, inverted_index, len(doc_nums),
+                                                                      top_k)
+            skipped_postings += n_skipped
+            query_postings += n_postings
+        elif mode == 'cosine':
+            query_scores = cosine_rank_query(query_tokens, inverted_index, len(doc_nums), top_k)
+        elif mode == 'impact':
+            query_scores, n_postings = impact_rank_query(query_tokens, impact_index, len(doc_nums), top_k, max_postings)
+            query_postings += n_postings
+        else:
+            raise ValueError('Unknown ranking mode: {}'.format(mode))
+
+        ranked_scores[query_index + 1] = query_scores
+
+    if mode == 'maxscore':
+        print('MaxScore skipped {} of the {} postings of the queries'.format(skipped_postings, query_postings))
+    elif mode == 'impact':
+        print('Impact-ordered search scored {} postings'.format(query_postings))
+    return ranked_scores
+
+
+def exhaustive_rank_query(query_tokens, inverted_index, N):
+    """Scores every document that contains any term of a query with TFIDF
+    Args:
+        query_tokens (list): Preprocessed query
+        inverted_index (dict)
+        N (int): Total number of documents
+    Returns:
+        (list): The (document id, score) pairs, on a descending order of score
+    """
+    # The terms that are not in the index do not match any document
+    query_tokens = [token for token in query_tokens if token in inverted_index]
+
+    # Convert query into an OR boolean search of its terms
+    query_docs = np.zeros(0, dtype=np.int64)
+    for token in query_tokens:
+        query_docs = union_sorted(query_docs, inverted_index[token].docs)
+
+    query_scores = []
+    # Map query_boolean_result to a list of document ids
+    for doc in query_docs.tolist():
+        score = TFIDF(doc, query_tokens, N, inverted_index)
+        query_scores.append((doc, score))
+
+    # Sort scores for each query on a descending order
+    return sorted(query_scores, key=lambda x: x[1], reverse=True)
+
+
+def create_weight_matrix(inverted_index, N):
+    """Creates the sparse term-document matrix of the TFIDF weights of the postings. The postings of the terms are
+    already sorted by term and document, so they are the rows of the matrix in CSR format
+    Args:
+        inverted_index (IndexReader)
+        N (int): Total number of documents
+    Returns:
+        (csr_matrix): The (1 + log10(tf)) * log10(N / df) weight of every term in every document
+    """
+    term_offsets, docs, tfs = inverted_index.doc_arrays()
+    dfs = np.diff(term_offsets)
+    weights = (1 + np.log10(tfs)) * np.repeat(np.log10(N / dfs), dfs)
+    return csr_matrix((weights, docs, term_offsets), shape=(len(dfs), N))
+
+
+def create_query_matrix(queries, inverted_index):
+    """Creates the sparse query-term matrix of how many times each term appears in each query. Terms that are not in
+    the index are left out
+    Args:
+        queries (list): Preprocessed ranked queries
+        inverted_index (IndexReader)
+    Returns:
+        (csr_matrix)
+    """
+    rows, columns = [], []
 
     for query_index, query_tokens in enumerate(queries):
-        # Convert query into an OR boolean search and use eval to evaluate it
-        boolean_vectors = []
         for token in query_tokens:
-            boolean_vector = collection_table[token]
-            boolean_vectors.append('np.array([{}])'.format(array_to_string(boolean_vector)))
+            if token in inverted_index:
+                rows.append(query_index)
+                columns.append(inverted_index.term_id(token))
 
-        query_eval_string = ' | '.join(boolean_vectors)
-        query_documents = boolean_search(query_eval_string, doc_nums)
+    counts = np.ones(len(rows))
+    return csr_matrix((counts, (rows, columns)), shape=(len(queries), len(inverted_index)))
 
-        query_scores = []
-        # Map query_boolean_result to a list of document ids
-        for doc in query_documents:
-            score = TFIDF(doc, query_tokens, len(doc_nums), inverted_index)
-            query_scores.append((doc, score))
 
-        # Sort scores for each query on a descending order
-        query_scores = sorted(query_scores, key=lambda x: x[1], reverse=True)
-        ranked_scores[query_index + 1] = query_scores
+def batch_ranked_retrieval(queries, doc_nums, inverted_index, weight_matrix=None):
+    """Performs ranked IR based on TFIDF for all the queries at once, with a single product of the sparse query-term
+    matrix and the term-document weight matrix. The results are the same as ranked_retrieval
+    Args:
+        queries (list): Queries from queries.ranked.txt
+        doc_nums (list): The document number of each document id
+        inverted_index (IndexReader)
+        weight_matrix (csr_matrix): The term-document matrix of create_weight_matrix, created if not given
+    Returns:
+        ranked_scores (dict): The resulting document ids and the score for each ranked query
+    """
+    print('Starting batch ranked retrieval...')
+    N = len(doc_nums)
+    if weight_matrix is None:
+        weight_matrix = create_weight_matrix(inverted_index, N)
+
+    scores = (create_query_matrix(queries, inverted_index) * weight_matrix).tocsr()
+    ranked_scores = {}
+
+    for query_index, query_tokens in enumerate(queries):
+        if any(inverted_index.df(token) == N for token in query_tokens if token in inverted_index):
+            # A term of every document has weight 0, so all documents match the query even with a score of 0
+            query_docs = np.arange(N)
+            query_doc_scores = scores[query_index].toarray().ravel()
+        else:
+            row = slice(scores.indptr[query_index], scores.indptr[query_index + 1])
+            query_docs, query_doc_scores = scores.indices[row], scores.data[row]
+
+        # Sort scores for each query on a descending order, ties by document id
+        order = np.lexsort((query_docs, -query_doc_scores))
+        ranked_scores[query_index + 1] = list(zip(query_docs[order].tolist(), query_doc_scores[order].tolist()))
 
     return ranked_scores
 
 
+def term_weights(postings, N):
+    """The TFIDF weight of a term in each document of its postings, (1 + log10(tf)) * log10(N / df)"""
+    return (1 + np.log10(postings.tfs)) * np.log10(N / postings.df)
+
+
+class Scorer(abc.ABC):
+    """The interface of the ranking functions of rank_query. The score of a document is the sum of the scores of the
+    query terms it contains, plus a score that only depends on the document and the length of the query. Both are
+    computed for many documents at once with numpy, so there are no Python calls per document
+    Args:
+        inverted_index (IndexReader)
+    """
+
+    def __init__(self, inverted_index):
+        self.inverted_index = inverted_index
+        self.N = len(inverted_index.doc_nums)
+
+    @abc.abstractmethod
+    def term_scores(self, term, postings):
+        """The score of a term in every document of its postings
+        Args:
+            term (str)
+            postings (Postings): The postings of the term
+        Returns:
+            (np.ndarray)
+        """
+
+    def doc_scores(self, doc_ids, query_length):
+        """The part of the score of some documents that does not depend on the query terms
+        Args:
+            doc_ids (np.ndarray)
+            query_length (int): The number of query terms that are in the index
+        Returns:
+            (np.ndarray)
+        """
+        return np.zeros(len(doc_ids))
+
+
+class TFIDFScorer(Scorer):
+    """(1 + log10(tf)) * log10(N / df), the same scores as TFIDF"""
+
+    def term_scores(self, term, postings):
+        return term_weights(postings, self.N)
+
+
+class BM25Scorer(Scorer):
+    """Okapi BM25, with the idf log(1 + (N - df + 0.5) / (df + 0.5)) which is never negative
+    Args:
+        inverted_index (IndexReader)
+        k1 (float): How quickly the score saturates with the term frequency
+        b (float): How much the term frequency is normalised by the document length
+    """
+
+    def __init__(self, inverted_index, k1=1.2, b=0.75):
+        super().__init__(inverted_index)
+        self.k1 = k1
+        self.b = b
+
+    def term_scores(self, term, postings):
+        idf = np.log(1 + (self.N - postings.df + 0.5) / (postings.df + 0.5))
+        doc_lengths = self.inverted_index.doc_lengths[postings.docs]
+        length_norm = self.k1 * (1 - self.b + self.b * doc_lengths / self.inverted_index.avg_doc_length)
+        return idf * postings.tfs * (self.k1 + 1) / (postings.tfs + length_norm)
+
+
+class DirichletScorer(Scorer):
+    """Query likelihood with Dirichlet smoothing. The log likelihood of the query is split in a score for each term
+    of the document, log(1 + tf / (mu * cf / |C|)), and a score of the document, |q| * log(mu / (|d| + mu)), so the
+    terms that are not in a document do not have to be scored. The scores differ from the log likelihood by a
+    constant of the query, so the ranking is the same
+    Args:
+        inverted_index (IndexReader)
+        mu (float): The weight of the collection language model
+    """
+
+    def __init__(self, inverted_index, mu=2000):
+        super().__init__(inverted_index)
+        self.mu = mu
+        self.collection_length = int(inverted_index.doc_lengths.sum())
+
+    def term_scores(self, term, postings):
+        collection_probability = self.inverted_index.cf(term) / self.collection_length
+        return np.log(1 + postings.tfs / (self.mu * collection_probability))
+
+    def doc_scores(self, doc_ids, query_length):
+        return query_length * np.log(self.mu / (self.inverted_index.doc_lengths[doc_ids] + self.mu))
+
+
+def rank_query(query_tokens, inverted_index, N, top_k=1000, scorer=None):
+    """Ranks the documents for a single query term at a time. The scores of the postings of each term are added to
+    an accumulator of scores indexed by document id, and the top_k documents are selected with a heap instead of
+    sorting all the documents that contain any term
+    Args:
+        query_tokens (list): Preprocessed query
+        inverted_index (IndexReader)
+        N (int): Total number of documents
+        top_k (int): The number of documents to return
+        scorer (Scorer): The ranking function, TFIDF if not given
+    Returns:
+        (list): The top_k (document id, score) pairs, on a descending order of score and then ascending document id
+    """
+    scorer = scorer if scorer is not None else TFIDFScorer(inverted_index)
+    scores = np.zeros(N)
+    matched = np.zeros(N, dtype=bool)
+    query_length = 0
+
+    for token in query_tokens:
+        if token in inverted_index:
+            postings = inverted_index[token]
+            scores[postings.docs] += scorer.term_scores(token, postings)
+            matched[postings.docs] = True
+            query_length += 1
+
+    query_docs = np.flatnonzero(matched)
+    scores[query_docs] += scorer.doc_scores(query_docs, query_length)
+    # nlargest keeps the documents with equal scores in document order, like a stable sort
+    return heapq.nlargest(top_k, zip(query_docs.tolist(), scores[query_docs].tolist()), key=lambda x: x[1])
+
+
+def cosine_rank_query(query_tokens, inverted_index, N, top_k=1000):
+    """Ranks the documents for a single query by the cosine similarity of the query and document vectors, so long
+    documents are not favoured. The dot products are accumulated a term at a time like rank_query, with the TFIDF
+    weights of the documents and the number of times each term appears in the query, and divided by the norms of the
+    document vectors stored in the index, without going through any other postings
+    Args:
+        query_tokens (list): Preprocessed query
+        inverted_index (IndexReader)
+        N (int): Total number of documents
+        top_k (int): The number of documents to return
+    Returns:
+        (list): The top_k (document id, score) pairs, on a descending order of score and then ascending document id
+    """
+    query_counts = Counter(token for token in query_tokens if token in inverted_index)
+    scores = np.zeros(N)
+    matched = np.zeros(N, dtype=bool)
+
+    for term, count in query_counts.items():
+        postings = inverted_index[term]
+        scores[postings.docs] += count * term_weights(postings, N)
+        matched[postings.docs] = True
+
+    query_docs = np.flatnonzero(matched)
+    query_norm = np.sqrt(sum(count ** 2 for count in query_counts.values()))
+    norms = inverted_index.doc_norms[query_docs] * query_norm
+    # Documents with only terms of every document have a zero vector
+    query_doc_scores = np.divide(scores[query_docs], norms, out=np.zeros(len(query_docs)), where=norms > 0)
+    return heapq.nlargest(top_k, zip(query_docs.tolist(), query_doc_scores.tolist()), key=lambda x: x[1])
+
+
+def score_docs(query_tokens, doc_ids, inverted_index, N):
+    """The TFIDF scores of some documents for a query, adding the weights of the terms in query order like
+    rank_query, so the scores are exactly the same
+    Args:
+        query_tokens (list): Preprocessed query
+        doc_ids (np.ndarray): Sorted document ids
+        inverted_index (IndexReader)
+        N (int): Total number of documents
+    Returns:
+        (np.ndarray): The score of each document
+    """
+    scores = np.zeros(len(doc_ids))
+
+    for token in query_tokens:
+        if token in inverted_index:
+            postings = inverted_index[token]
+            indices = np.searchsorted(postings.docs, doc_ids)
+            found = indices < len(postings.docs)
+            found[found] = postings.docs[indices[found]] == doc_ids[found]
+            scores[found] += term_weights(postings, N)[indices[found]]
+
+    return scores
+
+
+def kth_largest(values, k):
+    """The k-th largest value, or 0 if there are fewer than k values"""
+    return float(np.partition(values, -k)[-k]) if len(values) >= k else 0.0
+
+
+def maxscore_rank_query(query_tokens, inverted_index, N, top_k=1000):
+    """Ranks the documents for a single query like rank_query, with MaxScore dynamic pruning. The terms are scored a
+    term at a time in descending order of the upper bound of their weight, the highest TFIDF weight stored in the
+    index. The top_k-th best partial score is a lower bound of the score needed to enter the top_k, so once the upper
+    bounds of the remaining terms add up to less than it, the documents that only contain the remaining terms cannot
+    enter the top_k. From then on, the postings of the remaining terms are only searched for the documents found so
+    far which can still reach the top_k, and only the blocks of their skip lists that can hold those documents are
+    decoded. The top_k documents are finally rescored in query order, so the results are identical to rank_query
+    Args:
+        query_tokens (list): Preprocessed query
+        inverted_index (IndexReader)
+        N (int): Total number of documents
+        top_k (int): The number of documents to return
+    Returns:
+        (list): The top_k (document id, score) pairs, on a descending order of score and then ascending document id
+        n_skipped (int): The number of postings of the query terms that were never decoded
+        n_postings (int): The number of postings of the query terms
+    """
+    term_counts = Counter(token for token in query_tokens if token in inverted_index)
+    term_bounds = {term: count * inverted_index.max_tfidf(term) for term, count in term_counts.items()}
+    terms = sorted(term_bounds, key=term_bounds.get, reverse=True)
+    # The highest score a document can get from the terms after each term
+    remaining_bounds = [sum(term_bounds[term] for term in terms[index + 1:]) for index in range(len(terms))]
+
+    scores = np.zeros(N)
+    matched = np.zeros(N, dtype=bool)
+    threshold = 0.0
+    pruning = False
+    n_skipped, n_postings = 0, 0
+
+    for term_index, term in enumerate(terms):
+        df = inverted_index.df(term)
+        n_postings += df
+
+        if not pruning:
+            postings = inverted_index[term]
+            scores[postings.docs] += term_counts[term] * term_weights(postings, N)
+            matched[postings.docs] = True
+        else:
+            # Drop the documents that cannot reach the threshold even with this and all the remaining terms
+            candidates = np.flatnonzero(matched)
+            max_scores = scores[candidates] + term_bounds[term] + remaining_bounds[term_index]
+            unreachable = max_scores < threshold * (1 - SCORE_TOLERANCE)
+            matched[candidates[unreachable]] = False
+            candidates = candidates[~unreachable]
+
+            # Only the blocks of the postings that can hold the candidates are decoded, with the skip lists
+            postings, n_decoded = inverted_index.intersect_postings(term, candidates, with_positions=False)
+            scores[postings.docs] += term_counts[term] * (1 + np.log10(postings.tfs)) * np.log10(N / df)
+            n_skipped += df - n_decoded
+
+        threshold = max(threshold, kth_largest(scores[matched], top_k))
+        pruning = pruning or remaining_bounds[term_index] < threshold * (1 - SCORE_TOLERANCE)
+
+    # Every term has been added, so only the documents with a score close to the threshold are left to rescore
+    candidates = np.flatnonzero(matched)
+    candidates = candidates[scores[candidates] >= threshold * (1 - SCORE_TOLERANCE)]
+    candidate_scores = score_docs(query_tokens, candidates, inverted_index, N)
+
+    query_scores = heapq.nlargest(top_k, zip(candidates.tolist(), candidate_scores.tolist()), key=lambda x: x[1])
+    return query_scores, n_skipped, n_postings
+
+
+def impact_rank_query(query_tokens, impact_index, N, top_k=1000, max_postings=None):
+    """Ranks the documents for a single query score-at-a-time, with the impact-ordered postings. The segments of all
+    query terms are scored in decreasing order of impact, so the documents with the highest weights are scored first
+    and the search can stop early after max_postings postings, trading accuracy for speed. The scores are the sums of
+    the quantized weights, so they are close to the TFIDF scores but not exactly equal
+    Args:
+        query_tokens (list): Preprocessed query
+        impact_index (ImpactIndex)
+        N (int): Total number of documents
+        top_k (int): The number of documents to return
+        max_postings (int): Stop after scoring the segment that reaches this number of postings, None to score all
+    Returns:
+        (list): The top_k (document id, score) pairs, on a descending order of score and then ascending document id
+        n_postings (int): The number of postings that were scored
+    """
+    segments = []
+    for term, count in Counter(query_tokens).items():
+        segments.extend((count * impact, segment_id) for impact, segment_id in impact_index.segments(term))
+    segments.sort(key=lambda segment: segment[0], reverse=True)
+
+    scores = np.zeros(N, dtype=np.int64)
+    matched = np.zeros(N, dtype=bool)
+    n_postings = 0
+
+    for impact, segment_id in segments:
+        if max_postings is not None and n_postings >= max_postings:
+            break
+        segment_docs = impact_index.segment_docs(segment_id)
+        scores[segment_docs] += impact
+        matched[segment_docs] = True
+        n_postings += len(segment_docs)
+
+    query_docs = np.flatnonzero(matched)
+    query_doc_scores = (scores[query_docs] * impact_index.scale).tolist()
+    return heapq.nlargest(top_k, zip(query_docs.tolist(), query_doc_scores), key=lambda x: x[1]), n_postings
+
+
+def taat_ranked_retrieval(queries, doc_nums, inverted_index, stop_words, top_k=1000):
+    """Performs ranked IR based on TFIDF, scoring the queries one term at a time with rank_query. It takes the same
+    arguments as ranked_retrieval and returns the same results, cut to the top_k documents of each query that
+    save_ranked_retrieval_results writes
+    Args:
+        queries (list): Queries from queries.ranked.txt
+        doc_nums (list): The document number of each document id
+        inverted_index (dict)
+        stop_words (list)
+        top_k (int): The number of documents kept for each query
+    Returns:
+        ranked_scores (dict): The resulting document ids and the score for each ranked query
+    """
+    return ranked_retrieval(queries, doc_nums, inverted_index, stop_words, 'taat', top_k)
+
+
 def TFIDF(document, terms, N, inverted_index):
     """Calculates the retrieval score using the TFIDF (term frequency - inverse document frequency) formula
     Args:
-        document (str)
+        document (int): Document id
         terms (list)
         N (list): Total number of documents
         inverted_index (dict)
@@ -266,22 +818,24 @@ def TFIDF(document, terms, N, inverted_index):
 
     # For each term calculate the tf (term frequency in doc) and df (number of docs that word appeared in)
     for term in terms:
-        # Check if the document includes the term
-        if document in inverted_index[term].keys():
-            # Frequency of term in this document
-            tf = len(inverted_index[term][document])
+        postings = inverted_index[term]
+        # Frequency of term in this document, 0 if the document does not include the term
+        tf = postings.tf(document)
+
+        if tf > 0:
             # Number of documents in which the term appeared
-            df = len(inverted_index[term].keys())
+            df = postings.df
             term_weight = (1 + np.log10(tf)) * np.log10(N / df)
             total_score += term_weight
 
     return total_score
 
 
-def save_ranked_retrieval_results(ranked_results, file_name):
+def save_ranked_retrieval_results(ranked_results, doc_nums, file_name):
     """Saves the results for the ranked queries in the provided file_name
     Args:
         ranked_results (list)
+        doc_nums (list): The document number of each document id
         file_name (str)
     """
     f = open(file_name + '.txt', 'w+')
@@ -289,7 +843,7 @@ def save_ranked_retrieval_results(ranked_results, file_name):
     for query in ranked_results.keys():
         for index, (doc, score) in enumerate(ranked_results[query]):
             if index < 1000:
-                printed_res = str(query) + ' 0 ' + doc + ' 0 ' + '%.4f' % score + ' 0 \n'
+                printed_res = str(query) + ' 0 ' + doc_nums[doc] + ' 0 ' + '%.4f' % score + ' 0 \n'
                 f.write(printed_res)
     f.close()
     print('Ranked search results saved at {}.txt'.format(file_name))
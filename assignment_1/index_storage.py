@@ -0,0 +1,458 @@
+import json
+import mmap
+from collections import OrderedDict
+from collections.abc import Mapping
+import numpy as np
+from postings import Postings, intersect_sorted, find_sorted, tfidf_norms
+
+
+INDEX_MAGIC = b'TTDSIDX1'
+SECTION_ALIGNMENT = 8
+# Number of postings in a block of the skip list. Only the terms with longer postings get skips
+SKIP_BLOCK_SIZE = 128
+
+
+def vbyte_encode(values):
+    """Variable-byte encodes a list of non negative integers. Every value is split in groups of 7 bits, starting from
+    the least significant ones, and the high bit is set on the last byte of each value
+    Args:
+        values (np.ndarray): Non negative integers
+    Returns:
+        encoded (np.ndarray): The encoded bytes
+        n_bytes (np.ndarray): The number of bytes used for each value
+    """
+    values = np.asarray(values, dtype=np.int64)
+    n_bytes = np.ones(len(values), dtype=np.int64)
+    remaining = values >> 7
+
+    while remaining.any():
+        n_bytes += remaining > 0
+        remaining >>= 7
+
+    ends = np.cumsum(n_bytes)
+    starts = ends - n_bytes
+    encoded = np.zeros(ends[-1] if len(values) else 0, dtype=np.uint8)
+
+    for byte_index in range(int(n_bytes.max()) if len(values) else 0):
+        has_byte = n_bytes > byte_index
+        encoded[starts[has_byte] + byte_index] = (values[has_byte] >> (7 * byte_index)) & 0x7f
+
+    encoded[ends - 1] |= 0x80
+    return encoded, n_bytes
+
+
+def vbyte_decode(encoded):
+    """Decodes a variable-byte encoded buffer, the opposite of vbyte_encode
+    Args:
+        encoded (np.ndarray): The encoded bytes
+    Returns:
+        (np.ndarray): The decoded integers
+    """
+    ends = np.flatnonzero(encoded & 0x80)
+    if len(ends) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shifts = 7 * (np.arange(len(encoded)) - np.repeat(starts, ends - starts + 1))
+    payload = (encoded & 0x7f).astype(np.int64) << shifts
+    return np.add.reduceat(payload, starts)
+
+
+def vbyte_decode_at(encoded, indices):
+    """Decodes only some values of a variable-byte encoded buffer. The values are found from the high bits of their
+    last bytes, without decoding the rest of the buffer
+    Args:
+        encoded (np.ndarray): The encoded bytes
+        indices (np.ndarray): The indices of the values to decode
+    Returns:
+        (np.ndarray): The decoded integers
+    """
+    value_ends = np.flatnonzero(encoded & 0x80)
+    starts = np.concatenate(([0], value_ends[:-1] + 1))[indices]
+    n_bytes = value_ends[indices] - starts + 1
+    byte_indices = np.arange(n_bytes.sum()) + np.repeat(starts - (np.cumsum(n_bytes) - n_bytes), n_bytes)
+    return vbyte_decode(encoded[byte_indices])
+
+
+def delta_encode(values, starts):
+    """Replaces sorted values with the gaps between them. Every list starting at one of `starts` begins a new sequence
+    Args:
+        values (np.ndarray): Concatenated sorted lists
+        starts (np.ndarray): The index of the first value of each list
+    Returns:
+        gaps (np.ndarray)
+    """
+    gaps = np.array(values, dtype=np.int64)
+    gaps[1:] -= values[:-1]
+    gaps[starts] = values[starts]
+    return gaps
+
+
+def delta_decode(gaps, starts):
+    """Restores the values of lists encoded with delta_encode
+    Args:
+        gaps (np.ndarray): Concatenated lists of gaps
+        starts (np.ndarray): The index of the first value of each list
+    Returns:
+        (np.ndarray)
+    """
+    if len(gaps) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    totals = np.cumsum(gaps)
+    totals_before = np.concatenate(([0], totals[:-1]))
+    lengths = np.diff(np.append(starts, len(gaps)))
+    return totals - np.repeat(totals_before[starts], lengths)
+
+
+def smallest_uint_array(values):
+    # Offsets only need 64 bits for buffers larger than 4GB
+    return np.asarray(values, dtype=np.uint32 if len(values) == 0 or values[-1] < 2 ** 32 else np.uint64)
+
+
+def encode_strings(strings):
+    return np.frombuffer('\n'.join(strings).encode('utf-8'), dtype=np.uint8)
+
+
+def decode_strings(encoded):
+    return bytes(encoded).decode('utf-8').split('\n') if len(encoded) else []
+
+
+def write_sections(file_name, sections):
+    """Writes named numpy arrays to a binary file. The file starts with a magic number, the length of a JSON header
+    with the dtype, length and offset of each section, the header itself and then the aligned data of every section
+    Args:
+        file_name (str)
+        sections (dict): Numpy arrays for each section name
+    """
+    header = {}
+    offset = 0
+
+    for name, array in sections.items():
+        header[name] = {'dtype': array.dtype.str, 'count': len(array), 'offset': offset}
+        offset += -(-array.nbytes // SECTION_ALIGNMENT) * SECTION_ALIGNMENT
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    header_bytes += b' ' * (-(len(INDEX_MAGIC) + 8 + len(header_bytes)) % SECTION_ALIGNMENT)
+
+    with open(file_name, 'wb') as f:
+        f.write(INDEX_MAGIC)
+        f.write(np.uint64(len(header_bytes)).tobytes())
+        f.write(header_bytes)
+
+        for array in sections.values():
+            # The buffer of the array is written as it is, so a memory-mapped array is not copied into memory first
+            f.write(np.ascontiguousarray(array).data)
+            f.write(b'\0' * (-array.nbytes % SECTION_ALIGNMENT))
+
+
+def read_sections(buffer):
+    """Reads the sections of a buffer written by write_sections, without copying the data
+    Args:
+        buffer (bytes): The content of the file
+    Returns:
+        sections (dict): Numpy arrays for each section name
+    """
+    if bytes(buffer[:len(INDEX_MAGIC)]) != INDEX_MAGIC:
+        raise ValueError('Not a binary index file')
+
+    header_length = int(np.frombuffer(buffer, dtype=np.uint64, count=1, offset=len(INDEX_MAGIC))[0])
+    data_offset = len(INDEX_MAGIC) + 8 + header_length
+    header = json.loads(bytes(buffer[len(INDEX_MAGIC) + 8:data_offset]).decode('utf-8'))
+
+    sections = {}
+    for name, section in header.items():
+        sections[name] = np.frombuffer(buffer, dtype=np.dtype(section['dtype']), count=section['count'],
+                                       offset=data_offset + section['offset'])
+    return sections
+
+
+def get_skips(docs, term_offsets, value_bytes):
+    """Splits the postings of the terms with more than SKIP_BLOCK_SIZE documents in blocks and finds the last document
+    id of every block and where its encoded bytes end, so the blocks can be decoded on their own
+    Args:
+        docs (np.ndarray): The document ids of all postings
+        term_offsets (np.ndarray): Where the postings of each term start in `docs`, with their total number at the end
+        value_bytes (np.ndarray): The byte offset of every encoded value of the postings, as laid out by
+            save_index_binary, with the total number of bytes at the end
+    Returns:
+        skip_offsets (np.ndarray): Where the blocks of each term start in the skip arrays, with their total at the end
+        skip_docs (np.ndarray): The last document id of every block
+        skip_ends (np.ndarray): The byte offset after the last document gap of every block
+    """
+    dfs = np.diff(term_offsets)
+    n_blocks = np.where(dfs > SKIP_BLOCK_SIZE, -(-dfs // SKIP_BLOCK_SIZE), 0)
+    skip_offsets = np.zeros(len(dfs) + 1, dtype=np.int64)
+    np.cumsum(n_blocks, out=skip_offsets[1:])
+
+    block_terms = np.repeat(np.arange(len(dfs)), n_blocks)
+    blocks = np.arange(skip_offsets[-1]) - skip_offsets[block_terms]
+    last_postings = term_offsets[block_terms] + np.minimum((blocks + 1) * SKIP_BLOCK_SIZE, dfs[block_terms]) - 1
+
+    # The document gaps of a term are stored after the values of the previous terms, twice as many as their postings
+    skip_ends = value_bytes[last_postings + term_offsets[block_terms] + 1]
+    return skip_offsets, docs[last_postings], skip_ends
+
+
+def save_index_binary(inverted_index, file_name):
+    """Saves the positional inverted index in a compressed binary format. The terms are sorted and stored in a term
+    dictionary with their document frequencies. For every term, the documents are stored as the gaps between their
+    ids followed by their term frequencies, and the positions inside each document as the gaps between them. All the
+    integers are variable-byte encoded. The document numbers are stored once, as the table of the document ids.
+    Long postings also get a skip list of the last document id and the end of every block of SKIP_BLOCK_SIZE
+    documents, so a few blocks can be decoded without the rest of the postings. The highest TFIDF weight of every
+    term is stored as an upper bound of its score for ranked retrieval, along with the collection frequency of every
+    term and the length of every document for the other ranking functions, and the norm of the TFIDF vector of every
+    document for the cosine similarity
+    Args:
+        inverted_index (PostingsIndex)
+        file_name (str)
+    """
+    terms = list(inverted_index.keys())
+    term_offsets, docs, tfs, positions = inverted_index.arrays()
+    dfs = np.diff(term_offsets)
+    term_starts = term_offsets[:-1]
+    doc_starts = np.cumsum(tfs, dtype=np.int64) - tfs
+
+    # Every term stores its document gaps and then its term frequencies
+    doc_values = np.empty(2 * len(docs), dtype=np.int64)
+    value_positions = np.arange(len(docs)) + np.repeat(term_starts, dfs)
+    doc_values[value_positions] = delta_encode(docs, term_starts)
+    doc_values[value_positions + np.repeat(dfs, dfs)] = tfs
+    encoded_docs, doc_value_bytes = vbyte_encode(doc_values)
+    encoded_positions, position_bytes = vbyte_encode(delta_encode(positions, doc_starts))
+
+    # Byte offsets of the postings of every term in the encoded buffers
+    value_bytes = np.concatenate(([0], np.cumsum(doc_value_bytes)))
+    doc_offsets = value_bytes[2 * term_offsets]
+    skip_offsets, skip_docs, skip_ends = get_skips(docs, term_offsets, value_bytes)
+
+    # The weight (1 + log10(tf)) * log10(N / df) of a term is highest in the documents with its highest frequency
+    max_tfs = np.maximum.reduceat(tfs, term_starts) if len(tfs) else tfs
+    max_tfidf = (1 + np.log10(max_tfs)) * np.log10(len(inverted_index.doc_nums) / dfs)
+    cfs = np.add.reduceat(tfs, term_starts) if len(tfs) else tfs
+    position_offsets = np.concatenate(([0], np.cumsum(tfs, dtype=np.int64)))[term_offsets]
+    pos_offsets = np.concatenate(([0], np.cumsum(position_bytes)))[position_offsets]
+
+    write_sections(file_name + '.idx', {
+        'doc_nums': encode_strings(inverted_index.doc_nums),
+        'terms': encode_strings(terms),
+        'df': dfs.astype(np.uint32),
+        'doc_offsets': smallest_uint_array(doc_offsets),
+        'docs': encoded_docs,
+        'pos_offsets': smallest_uint_array(pos_offsets),
+        'positions': encoded_positions,
+        'skip_offsets': smallest_uint_array(skip_offsets),
+        'skip_docs': skip_docs.astype(np.uint32),
+        'skip_ends': smallest_uint_array(skip_ends),
+        'max_tfidf': max_tfidf.astype(np.float64),
+        'cf': smallest_uint_array(cfs),
+        'doc_lengths': inverted_index.doc_lengths.astype(np.uint32),
+        'doc_norms': tfidf_norms(docs, tfs, dfs, len(inverted_index.doc_nums)).astype(np.float64),
+    })
+
+
+class IndexReader(Mapping):
+    """Read-only inverted index backed by a memory-mapped file saved by save_index_binary. Only the term dictionary
+    and the document numbers are loaded when the index is opened. The postings of a term are decoded the first time
+    they are looked up and the most recently used terms are kept decoded in an LRU cache. It can be used like the
+    PostingsIndex, so terms map to their Postings. doc_nums holds the document number of each document id
+    Args:
+        file_name (str)
+        cache_size (int): The maximum number of terms kept decoded
+    """
+
+    def __init__(self, file_name, cache_size=4096):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._file = open(file_name + '.idx', 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        sections = read_sections(self._mmap)
+        self.doc_nums = decode_strings(sections['doc_nums'])
+        self._term_ids = {term: term_id for term_id, term in enumerate(decode_strings(sections['terms']))}
+        self._dfs = sections['df']
+        self._doc_offsets = sections['doc_offsets']
+        self._docs = sections['docs']
+        self._pos_offsets = sections['pos_offsets']
+        self._positions = sections['positions']
+        self._skip_offsets = sections['skip_offsets']
+        self._skip_docs = sections['skip_docs']
+        self._skip_ends = sections['skip_ends']
+        self._max_tfidf = sections['max_tfidf']
+        self._cfs = sections['cf']
+        # The number of terms of each document, after removing the stop words
+        self.doc_lengths = sections['doc_lengths']
+        self.avg_doc_length = float(self.doc_lengths.mean()) if len(self.doc_lengths) else 0.0
+        # The length of the TFIDF vector of each document
+        self.doc_norms = sections['doc_norms']
+
+    def __getitem__(self, term):
+        if term in self._cache:
+            self._cache.move_to_end(term)
+            return self._cache[term]
+
+        term_postings = self._decode_postings(self._term_ids[term])
+        self._cache[term] = term_postings
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return term_postings
+
+    def __contains__(self, term):
+        return term in self._term_ids
+
+    def __iter__(self):
+        return iter(self._term_ids)
+
+    def __len__(self):
+        return len(self._term_ids)
+
+    def term_id(self, term):
+        """The index of a term in the sorted term dictionary"""
+        return self._term_ids[term]
+
+    def df(self, term):
+        """Document frequency of a term, read from the term dictionary without decoding its postings"""
+        return int(self._dfs[self._term_ids[term]])
+
+    def cf(self, term):
+        """Collection frequency of a term, the number of times it appears in all documents"""
+        return int(self._cfs[self._term_ids[term]])
+
+    def max_tfidf(self, term):
+        """The highest TFIDF weight of a term in any document, read from the term dictionary"""
+        return float(self._max_tfidf[self._term_ids[term]])
+
+    def doc_arrays(self):
+        """Decodes the documents of all postings at once, without their positions
+        Returns:
+            term_offsets (np.ndarray): Where the postings of each term start, with their total number at the end
+            docs (np.ndarray): The document ids of all postings
+            tfs (np.ndarray): The term frequency of all postings
+        """
+        dfs = self._dfs.astype(np.int64)
+        term_offsets = np.zeros(len(dfs) + 1, dtype=np.int64)
+        np.cumsum(dfs, out=term_offsets[1:])
+        term_starts = term_offsets[:-1]
+
+        doc_values = vbyte_decode(self._docs)
+        value_positions = np.arange(term_offsets[-1]) + np.repeat(term_starts, dfs)
+        docs = delta_decode(doc_values[value_positions], term_starts)
+        return term_offsets, docs, doc_values[value_positions + np.repeat(dfs, dfs)]
+
+    def intersect_docs(self, term, doc_ids):
+        """Finds which documents of a sorted array contain a term. If the postings of the term are not decoded yet,
+        the skip list of the term is searched for the blocks that can hold the documents and only those blocks are
+        decoded, so a short array is intersected with long postings without decoding all of them
+        Args:
+            term (str)
+            doc_ids (np.ndarray): Sorted document ids
+        Returns:
+            (np.ndarray): The sorted document ids that contain the term
+        """
+        term_id = self._term_ids[term]
+        skip_start, skip_end = int(self._skip_offsets[term_id]), int(self._skip_offsets[term_id + 1])
+        if term in self._cache or skip_start == skip_end or len(doc_ids) == 0:
+            return intersect_sorted(doc_ids, self[term].docs)
+
+        skip_docs = self._skip_docs[skip_start:skip_end]
+        doc_blocks = np.searchsorted(skip_docs, doc_ids)
+        blocks = np.unique(doc_blocks[doc_blocks < len(skip_docs)])
+        if len(blocks) == len(skip_docs):
+            return intersect_sorted(doc_ids, self[term].docs)
+
+        return intersect_sorted(doc_ids, self._decode_blocks(term_id, skip_start, blocks))
+
+    def intersect_postings(self, term, doc_ids, with_positions=True):
+        """The postings of a term restricted to the documents of a sorted array. Like intersect_docs, only the blocks of
+        the skip list that can hold the documents are decoded, and then only the term frequencies and positions of the
+        documents that contain the term
+        Args:
+            term (str)
+            doc_ids (np.ndarray): Sorted document ids
+            with_positions (bool): Whether to decode the positions too, otherwise the positions are left empty
+        Returns:
+            (Postings): The postings of the documents that contain the term
+            (int): The number of postings whose document ids were decoded, or read from the cache
+        """
+        term_id = self._term_ids[term]
+        df = int(self._dfs[term_id])
+        skip_start, skip_end = int(self._skip_offsets[term_id]), int(self._skip_offsets[term_id + 1])
+        if term in self._cache or skip_start == skip_end or len(doc_ids) == 0:
+            postings = self[term]
+            return postings.select(find_sorted(postings.docs, doc_ids)), df
+
+        skip_docs = self._skip_docs[skip_start:skip_end]
+        doc_blocks = np.searchsorted(skip_docs, doc_ids)
+        blocks = np.unique(doc_blocks[doc_blocks < len(skip_docs)])
+        if len(blocks) == len(skip_docs):
+            postings = self[term]
+            return postings.select(find_sorted(postings.docs, doc_ids)), df
+
+        # The index of every decoded document in the postings of the term
+        block_docs = self._decode_blocks(term_id, skip_start, blocks)
+        block_lengths = np.minimum(df - blocks * SKIP_BLOCK_SIZE, SKIP_BLOCK_SIZE)
+        value_starts = np.cumsum(block_lengths) - block_lengths
+        block_indices = np.arange(len(block_docs)) - np.repeat(value_starts - blocks * SKIP_BLOCK_SIZE, block_lengths)
+        found = find_sorted(block_docs, doc_ids)
+        docs, indices = block_docs[found].astype(np.int32), block_indices[found]
+
+        # The term frequencies follow the document gaps, which end with the last block
+        encoded_tfs = self._docs[int(self._skip_ends[skip_end - 1]):int(self._doc_offsets[term_id + 1])]
+        if not with_positions:
+            tfs = vbyte_decode_at(encoded_tfs, indices).astype(np.int32)
+            return Postings(docs, tfs, np.zeros(0, dtype=np.int32)), len(block_docs)
+
+        # The positions of a document start after the positions of the previous documents, so all the term
+        # frequencies are needed to find them
+        all_tfs = vbyte_decode(encoded_tfs)
+        tfs = all_tfs[indices].astype(np.int32)
+        position_starts = (np.cumsum(all_tfs) - all_tfs)[indices]
+        position_indices = np.arange(tfs.sum()) + np.repeat(position_starts - (np.cumsum(tfs) - tfs), tfs)
+        encoded_positions = self._positions[self._pos_offsets[term_id]:self._pos_offsets[term_id + 1]]
+        offsets = np.zeros(len(tfs) + 1, dtype=np.int64)
+        np.cumsum(tfs, out=offsets[1:])
+        positions = delta_decode(vbyte_decode_at(encoded_positions, position_indices), offsets[:-1]).astype(np.int32)
+        return Postings(docs, tfs, positions, offsets), len(block_docs)
+
+    def _decode_blocks(self, term_id, skip_start, blocks):
+        """Decodes the document ids of some blocks of the postings of a term"""
+        block_ends = self._skip_ends[skip_start + blocks].astype(np.int64)
+        block_starts = np.where(blocks > 0, self._skip_ends[skip_start + blocks - 1], self._doc_offsets[term_id])
+        block_starts = block_starts.astype(np.int64)
+        # The gaps of every block start from the last document id of the previous block
+        block_bases = np.where(blocks > 0, self._skip_docs[skip_start + blocks - 1], 0).astype(np.int64)
+
+        n_bytes = block_ends - block_starts
+        byte_indices = np.arange(n_bytes.sum()) + np.repeat(block_starts - (np.cumsum(n_bytes) - n_bytes), n_bytes)
+        gaps = vbyte_decode(self._docs[byte_indices])
+
+        block_lengths = np.minimum(int(self._dfs[term_id]) - blocks * SKIP_BLOCK_SIZE, SKIP_BLOCK_SIZE)
+        value_starts = np.cumsum(block_lengths) - block_lengths
+        return delta_decode(gaps, value_starts) + np.repeat(block_bases, block_lengths)
+
+    def _decode_postings(self, term_id):
+        df = int(self._dfs[term_id])
+        doc_values = vbyte_decode(self._docs[self._doc_offsets[term_id]:self._doc_offsets[term_id + 1]])
+        docs = np.cumsum(doc_values[:df]).astype(np.int32)
+        tfs = doc_values[df:].astype(np.int32)
+        offsets = np.zeros(df + 1, dtype=np.int64)
+        np.cumsum(tfs, out=offsets[1:])
+
+        encoded_positions = self._positions[self._pos_offsets[term_id]:self._pos_offsets[term_id + 1]]
+        positions = delta_decode(vbyte_decode(encoded_positions), offsets[:-1]).astype(np.int32)
+        return Postings(docs, tfs, positions, offsets)
+
+    def close(self):
+        self._cache.clear()
+        self._dfs = self._doc_offsets = self._docs = self._pos_offsets = self._positions = None
+        self._skip_offsets = self._skip_docs = self._skip_ends = self._max_tfidf = self._cfs = None
+        self.doc_lengths = self.doc_norms = None
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
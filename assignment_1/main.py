@@ -1,10 +1,21 @@
 import urllib.request
 import os.path
-import pickle
+import numpy as np
+from itertools import islice
+from multiprocessing import Pool
 import xml.etree.ElementTree as ElementTree
 from collections import Counter
-from preprocess import tokenise, remove_stop_words, stemming
-from index_search import create_term_doc_collection, boolean_search_queries, save_boolean_search_results, ranked_retrieval, save_ranked_retrieval_results
+from preprocess import (tokenise, tokenise_with_offsets, remove_stop_words, stemming, new_stems, add_stems,
+                        save_stem_table, load_stem_table)
+from index_storage import save_index_binary, IndexReader
+from postings import PostingsIndex
+from biword_index import save_biword_index, BiwordIndex
+from impact_index import save_impact_index
+from forward_index import save_forward_index, ForwardIndex
+from doc_store import store_documents, DOC_STORE_BLOCK_SIZE, DocStore
+from snippets import save_snippets
+from index_search import (create_term_doc_collection, boolean_search_queries, save_boolean_search_results,
+                          batch_ranked_retrieval, save_ranked_retrieval_results)
 
 
 def download_file_and_save(url, file_name):
@@ -26,13 +37,52 @@ def preprocess(doc):
     return stemming(remove_stop_words(tokenise(doc), stop_words))
 
 
+def preprocess_with_offsets(doc):
+    """Preprocesses a document like preprocess and keeps the character offsets of the remaining tokens, so the term
+    at every position of the document can be found in its text
+    Args:
+        doc (str)
+    Returns:
+        (list): The preprocessed tokens
+        (np.ndarray): The (start, end) character offsets of each token
+    """
+    tokens, offsets = tokenise_with_offsets(doc)
+    kept = [index for index, token in enumerate(tokens) if token not in stop_words]
+    kept_offsets = np.array([offsets[index] for index in kept], dtype=np.int32).reshape(-1, 2)
+    return stemming([tokens[index] for index in kept]), kept_offsets
+
+
+def read_xml_chunks(xml_file, chunk_size=1 << 16):
+    """Reads the xml file in chunks, wrapped in a root tag since the TREC files have multiple top level documents"""
+    yield '<ROOT>'
+    with open(xml_file, 'r') as f:
+        for chunk in iter(lambda: f.read(chunk_size), ''):
+            yield chunk
+    yield '</ROOT>'
+
+
 def load_xml(xml_file, tag):
-    with open(xml_file, 'r') as xml_file:   # Read xml file
-        xml = xml_file.read()
+    """Streams the documents of a TREC xml file. The file is fed to an incremental parser chunk by chunk and each
+    document is cleared from the tree as soon as it has been parsed, so memory usage does not grow with the collection
+    Args:
+        xml_file (str): The path of the TREC xml file
+        tag (str): The tag of the document elements
+    Yields:
+        (tuple): The DOCNO, HEADLINE and TEXT of each document
+    """
+    parser = ElementTree.XMLPullParser(events=('start', 'end'))
+    root = None
+
+    for xml_chunk in read_xml_chunks(xml_file):
+        parser.feed(xml_chunk)
 
-    xml = '<ROOT>' + xml + '</ROOT>'   # Add a root tag
-    root = ElementTree.fromstring(xml)
-    return root
+        for event, element in parser.read_events():
+            if root is None:
+                root = element
+            elif event == 'end' and element.tag == tag:
+                yield element.findtext('DOCNO'), element.findtext('HEADLINE'), element.findtext('TEXT')
+                root.clear()    # Drop the documents that have already been yielded
+    parser.close()
 
 
 def word_freq_in_doc(doc):
@@ -51,32 +101,160 @@ def get_word_indices_in_text(words, text):
     return word_indices
 
 
-def find_indices_of_word(doc_list, word):
-    indices_list = [i + 1 for i in range(len(doc_list)) if doc_list[i] == word]
-    return indices_list
+def invert_documents(tokenised_docs, first_doc_id=0):
+    """Builds a positional inverted index in memory. Each document is walked once and the position of every token is
+    appended to the postings of its term, so the build is linear in the collection size
+    Args:
+        tokenised_docs (list): Tokenised documents in the order they are indexed
+        first_doc_id (int): The document id of the first document
+    Returns:
+        inverted_index (dict): Index of terms as keys and dict of document ids with positions as values
+    """
+    inverted_index = dict()
+
+    for doc_id, token_doc_list in enumerate(tokenised_docs, first_doc_id):
+        for position, word in enumerate(token_doc_list, 1):
+            word_docs = inverted_index.setdefault(word, {})
+
+            if doc_id in word_docs:
+                word_docs[doc_id].append(position)
+            else:
+                word_docs[doc_id] = [position]
+
+    return inverted_index
+
+
+def init_worker(worker_stop_words, stem_table_file=None):
+    # The stop words are only defined in __main__, so they have to be passed to the worker processes explicitly
+    global stop_words
+    stop_words = worker_stop_words
+    if stem_table_file is not None:
+        load_stem_table(stem_table_file)
+
+
+def preprocess_and_invert(docs_chunk):
+    """Preprocesses a chunk of documents and creates its partial positional index. Runs in a worker process
+    Args:
+        docs_chunk (tuple): The document id of the first document in the chunk and the (document number,
+            headline with text) pairs of the chunk
+    Returns:
+        (tuple): The document numbers of the chunk, its partial inverted index, the token offsets of its documents
+            and the words stemmed for the first time by the worker
+    """
+    first_doc_id, docs = docs_chunk
+    tokenised_docs, token_offsets = zip(*[preprocess_with_offsets(text) for _, text in docs])
+    doc_nums = [doc_no for doc_no, _ in docs]
+    return doc_nums, invert_documents(tokenised_docs, first_doc_id), list(token_offsets), new_stems()
+
+
+def split_in_chunks(docs, chunk_size):
+    docs = iter(docs)
+    first_doc_id = 0
+    docs_chunk = list(islice(docs, chunk_size))
+
+    while docs_chunk:
+        yield first_doc_id, docs_chunk
+        first_doc_id += len(docs_chunk)
+        docs_chunk = list(islice(docs, chunk_size))
+
 
+def merge_partial_index(inverted_index, partial_index):
+    """Merges the partial inverted index of a chunk of documents into inverted_index. The chunks must be merged in
+    document order, so the postings of every term stay sorted by document
+    Args:
+        inverted_index (dict)
+        partial_index (dict): Partial inverted index of the next chunk of documents
+    """
+    for word, word_docs in partial_index.items():
+        if word in inverted_index:
+            inverted_index[word].update(word_docs)
+        else:
+            inverted_index[word] = word_docs
 
-def create_inverted_index(tokenised_docs):
-    """Creates the positional inverted incdex from a list of tokenised documents
+
+def create_inverted_index(docs, biword_min_df=None, impact_ordered=False):
+    """Creates the positional inverted incdex from the documents of the collection. Every document gets a dense
+    integer id, its index in the document numbers which are saved with the index
     Args:
-        tokenised_docs (dict): Tokenised documents for each document number
+        docs (iterable): (document number, headline with text) pairs
+        biword_min_df (int): If given, a biword index of the pairs of adjacent terms that appear in at least
+            biword_min_df documents is saved next to the index
+        impact_ordered (bool): Whether to save the impact-ordered postings for ranked retrieval next to the index
+    Returns:
+        doc_nums (list): The document numbers in the order they were indexed
     """
     print('Create inverted index...')
-    inverted_index = dict()
+    doc_nums = []
+    tokenised_docs = []
+    token_offsets = []
 
-    for doc_no, token_doc_list in tokenised_docs.items():
-        for word in token_doc_list:
-            word_indices = find_indices_of_word(token_doc_list, word)
-            doc_indices_dict = {}
-            doc_indices_dict[doc_no] = word_indices
-            if word in inverted_index:
-                inverted_index[word].update(doc_indices_dict)
-            else:
-                inverted_index.setdefault(word, doc_indices_dict)
+    for doc_no, text in docs:
+        doc_nums.append(doc_no)
+        doc_tokens, doc_offsets = preprocess_with_offsets(text)
+        tokenised_docs.append(doc_tokens)
+        token_offsets.append(doc_offsets)
+
+    inverted_index = invert_documents(tokenised_docs)
 
-    # Save inverted index in txt file in the required format and binary file
+    save_index(inverted_index, doc_nums, token_offsets, biword_min_df, impact_ordered)
+    return doc_nums
+
+
+def create_inverted_index_parallel(docs, processes=None, chunk_size=256, biword_min_df=None, impact_ordered=False):
+    """Creates the positional inverted index using a pool of processes. The documents are split into chunks which are
+    preprocessed and inverted in parallel, while the partial indexes are merged in order as soon as they are ready.
+    The result is identical to create_inverted_index
+    Args:
+        docs (iterable): (document number, headline with text) pairs
+        processes (int): Number of worker processes, defaults to the number of CPUs
+        chunk_size (int): Number of documents sent to a worker at a time
+        biword_min_df (int): If given, a biword index of the pairs of adjacent terms that appear in at least
+            biword_min_df documents is saved next to the index
+        impact_ordered (bool): Whether to save the impact-ordered postings for ranked retrieval next to the index
+    Returns:
+        doc_nums (list): The document numbers in the order they were indexed
+    """
+    print('Create inverted index in parallel...')
+    inverted_index = dict()
+    doc_nums = []
+    token_offsets = []
+
+    # The workers are warm started from the stem table of the last build, and send back the words they stem, so the
+    # stem table saved with the index covers the whole collection
+    with Pool(processes, initializer=init_worker, initargs=(stop_words, INVERTED_INDEX_FILE)) as pool:
+        for chunk_doc_nums, partial_index, chunk_offsets, chunk_stems in pool.imap(preprocess_and_invert,
+                                                                                    split_in_chunks(docs, chunk_size)):
+            doc_nums.extend(chunk_doc_nums)
+            token_offsets.extend(chunk_offsets)
+            add_stems(chunk_stems)
+            merge_partial_index(inverted_index, partial_index)
+
+    save_index(inverted_index, doc_nums, token_offsets, biword_min_df, impact_ordered)
+    return doc_nums
+
+
+def save_index(inverted_index, doc_nums, token_offsets=None, biword_min_df=None, impact_ordered=False):
+    """Stores the postings in flat arrays and saves them in txt file in the required format and binary file, along
+    with the forward index of the term vectors of the documents, the stem table and the optional biword and
+    impact-ordered indexes
+    Args:
+        inverted_index (dict): Index of terms as keys and dict of document ids with positions as values
+        doc_nums (list): The document numbers in the order they were indexed
+        token_offsets (list): The character offsets of the tokens of every document, saved in the forward index for
+            the snippets
+        biword_min_df (int): The frequency threshold of the biword index, or None to skip it
+        impact_ordered (bool): Whether to save the impact-ordered postings for ranked retrieval
+    """
+    inverted_index = PostingsIndex.from_dict(inverted_index, doc_nums)
     save_inverted_index_txt(inverted_index, INVERTED_INDEX_FILE)
-    save_file_binary(inverted_index, INVERTED_INDEX_FILE)
+    save_index_binary(inverted_index, INVERTED_INDEX_FILE)
+    save_forward_index(inverted_index, INVERTED_INDEX_FILE, token_offsets)
+    save_stem_table(INVERTED_INDEX_FILE)
+
+    if biword_min_df is not None:
+        save_biword_index(inverted_index, INVERTED_INDEX_FILE, biword_min_df)
+    if impact_ordered:
+        save_impact_index(inverted_index, INVERTED_INDEX_FILE)
 
 
 def save_inverted_index_txt(inverted_index, file_name):
@@ -84,26 +262,16 @@ def save_inverted_index_txt(inverted_index, file_name):
         sorted_words = sorted(inverted_index.keys())
 
         for word in sorted_words:
-            indices_dict = inverted_index[word]
+            postings = inverted_index[word]
             f.write(word + ':\n')
 
-            for doc_num in indices_dict:
-                indices_str = ', '.join(map(str, indices_dict[doc_num]))
-                f.write('  ' + str(doc_num) + ': ' + indices_str + '\n')
+            for index, doc_id in enumerate(postings.docs.tolist()):
+                indices_str = ', '.join(map(str, postings.positions_at(index).tolist()))
+                f.write('  ' + inverted_index.doc_nums[doc_id] + ': ' + indices_str + '\n')
             f.write('\n')
         print('Inverted index saved at {}.txt\n'.format(file_name))
 
 
-def save_file_binary(obj, file_name):
-    with open(file_name + '.pkl', 'wb') as f:
-        pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
-
-
-def load_file_binary(file_name):
-    with open(file_name + '.pkl', 'rb') as f:
-        return pickle.load(f)
-
-
 def create_directory(directory):
     if not os.path.isdir(directory):
         os.makedirs(directory)
@@ -122,6 +290,20 @@ if __name__ == '__main__':
     INVERTED_INDEX_FILE = RESULTS_DIR + '/index'
     RESULTS_BOOLEAN_FILE = RESULTS_DIR + '/results.boolean'
     RESULTS_RANKED_FILE = RESULTS_DIR + '/results.ranked'
+    RESULTS_SNIPPETS_FILE = RESULTS_DIR + '/results.snippets'
+    # Number of processes used to build the inverted index
+    BUILD_PROCESSES = os.cpu_count()
+    # Build a biword index for phrase search, with the pairs of terms that appear in at least this many documents.
+    # None skips the biword index, higher thresholds keep it smaller
+    BIWORD_MIN_DF = 2
+    # Also save the postings sorted by quantized TFIDF impact, for the 'impact' mode of ranked_retrieval. The ranked
+    # search below does not use them, so they are not saved by default
+    IMPACT_ORDERED_INDEX = False
+    # Evaluate the boolean queries on compressed bitmaps of the documents of every term, instead of merging the
+    # postings lists of their terms
+    BOOLEAN_BITMAPS = False
+    # Number of top ranked results of each query with a snippet
+    SNIPPETS_PER_QUERY = 10
 
     # Create the directory for the results files
     create_directory(RESULTS_DIR)
@@ -132,6 +314,9 @@ if __name__ == '__main__':
     with open(STOP_WORDS_FILE) as file:
         stop_words = [word.strip() for word in file]
 
+    # Warm start the stem cache with the stems of the previous build, which are also used to stem the queries
+    load_stem_table(INVERTED_INDEX_FILE)
+
     # Preprocess the queries for the boolean, phrase and proximity search
     with open(QUERIES_BOOLEAN) as queries_boolean_file:
         queries_boolean = [query.lower().split(' ', 1)[1] for query in queries_boolean_file]
@@ -142,28 +327,32 @@ if __name__ == '__main__':
         for query in queries_ranked_file:
             queries_ranked.append(preprocess(query.split(' ', 1)[1]))
 
-    # Load the provided TREC xml file
-    root = load_xml(TREC_FILE, './DOC')
-    tokenised_docs = {}    # Key-value pairs for the document numbers and the text (including headline)
-    doc_nums = []   # A list of all the document numbers
-
-    for doc in root:
-        doc_no = doc.find('DOCNO').text
-        doc_nums.append(doc_no)
-        headline_with_text = doc.find('HEADLINE').text + ' ' + doc.find('TEXT').text
-        tokenised_docs[doc_no] = preprocess(headline_with_text)
-
-    # Create the inverted index and load it from the binary file
-    create_inverted_index(tokenised_docs)
-    inverted_index = load_file_binary('./' + INVERTED_INDEX_FILE)
-
-    # Create a term-document incident collection that shows which documents each term belongs to
-    collection_table = create_term_doc_collection(inverted_index, doc_nums)
-
-    # Boolean, phrase and proximity search
-    boolean_search_results = boolean_search_queries(queries_boolean, collection_table, inverted_index, doc_nums)
-    save_boolean_search_results(queries_boolean, boolean_search_results, RESULTS_BOOLEAN_FILE)
-
-    # Ranked search
-    ranked_retrieval_results = ranked_retrieval(queries_ranked, collection_table, doc_nums, inverted_index, stop_words)
-    save_ranked_retrieval_results(ranked_retrieval_results, RESULTS_RANKED_FILE)
+    # Stream the documents of the provided TREC xml file as pairs of document number and text (including headline)
+    docs = ((doc_no, headline + ' ' + text) for doc_no, headline, text in load_xml(TREC_FILE, 'DOC'))
+    # The text of the documents is also saved in a compressed document store while they are indexed
+    docs = store_documents(docs, INVERTED_INDEX_FILE, DOC_STORE_BLOCK_SIZE)
+
+    # Create the inverted index and open the binary file, which decodes the postings of each term on demand
+    if BUILD_PROCESSES > 1:
+        create_inverted_index_parallel(docs, BUILD_PROCESSES, biword_min_df=BIWORD_MIN_DF,
+                                       impact_ordered=IMPACT_ORDERED_INDEX)
+    else:
+        create_inverted_index(docs, BIWORD_MIN_DF, IMPACT_ORDERED_INDEX)
+    inverted_index = IndexReader('./' + INVERTED_INDEX_FILE)
+    doc_nums = inverted_index.doc_nums   # The document numbers of the dense document ids used in the index
+    biword_index = BiwordIndex('./' + INVERTED_INDEX_FILE, inverted_index) if BIWORD_MIN_DF is not None else None
+
+    # Boolean, phrase and proximity search by merging the postings lists of the terms, or on their bitmaps
+    collection_table = create_term_doc_collection(inverted_index, doc_nums) if BOOLEAN_BITMAPS else None
+    boolean_search_results = boolean_search_queries(queries_boolean, collection_table, inverted_index, doc_nums,
+                                                    biword_index)
+    save_boolean_search_results(queries_boolean, boolean_search_results, doc_nums, RESULTS_BOOLEAN_FILE)
+
+    # Ranked search of all queries at once, with the sparse matrix of the TFIDF weights
+    ranked_retrieval_results = batch_ranked_retrieval(queries_ranked, doc_nums, inverted_index)
+    save_ranked_retrieval_results(ranked_retrieval_results, doc_nums, RESULTS_RANKED_FILE)
+
+    # Snippets of the top results from the positions of the query terms, the token offsets and the document store
+    with ForwardIndex('./' + INVERTED_INDEX_FILE) as forward_index, DocStore('./' + INVERTED_INDEX_FILE) as doc_store:
+        save_snippets(queries_ranked, ranked_retrieval_results, doc_nums, inverted_index, forward_index, doc_store,
+                      RESULTS_SNIPPETS_FILE, SNIPPETS_PER_QUERY)
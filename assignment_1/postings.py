@@ -0,0 +1,218 @@
+from collections.abc import Mapping
+import numpy as np
+
+
+class Postings:
+    """The postings of a single term, stored in contiguous numpy arrays instead of a dict of lists
+    Args:
+        docs (np.ndarray): Sorted ids of the documents that contain the term
+        tfs (np.ndarray): The term frequency in each document
+        positions (np.ndarray): The positions of the term in all of its documents, grouped by document
+        offsets (np.ndarray): Where the positions of each document start in `positions`, with the total number of
+            positions at the end. It is computed from `tfs` when not given
+    """
+    __slots__ = ('docs', 'tfs', 'positions', 'offsets')
+
+    def __init__(self, docs, tfs, positions, offsets=None):
+        self.docs = docs
+        self.tfs = tfs
+        self.positions = positions
+        if offsets is None:
+            offsets = np.zeros(len(tfs) + 1, dtype=np.int64)
+            np.cumsum(tfs, out=offsets[1:])
+        self.offsets = offsets
+
+    @property
+    def df(self):
+        return len(self.docs)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __iter__(self):
+        return iter(self.docs.tolist())
+
+    def __contains__(self, doc_id):
+        return self.find(doc_id) >= 0
+
+    def find(self, doc_id):
+        """Returns the index of a document in the postings, or -1 if the term does not appear in it"""
+        index = int(np.searchsorted(self.docs, doc_id))
+        return index if index < len(self.docs) and self.docs[index] == doc_id else -1
+
+    def tf(self, doc_id):
+        index = self.find(doc_id)
+        return int(self.tfs[index]) if index >= 0 else 0
+
+    def positions_at(self, index):
+        """The positions of the term in the document at `index` of the postings"""
+        return self.positions[self.offsets[index]:self.offsets[index + 1]]
+
+    def positions_in(self, doc_id):
+        """The positions of the term in a document, empty if the term does not appear in it"""
+        index = self.find(doc_id)
+        return self.positions_at(index) if index >= 0 else self.positions[:0]
+
+    def select(self, indices):
+        """The postings of the documents at some indices of the postings"""
+        tfs = self.tfs[indices]
+        starts = self.offsets[:-1][indices]
+        position_indices = np.arange(tfs.sum()) + np.repeat(starts - (np.cumsum(tfs) - tfs), tfs)
+        return Postings(self.docs[indices], tfs, self.positions[position_indices])
+
+
+class PostingsIndex(Mapping):
+    """In-memory positional inverted index. The postings of all terms are concatenated into a few flat arrays and
+    every term maps to a Postings made of views into them, so the index costs a few bytes per posting instead of the
+    Python objects of a dict of lists
+    Args:
+        terms (list): The terms of the index
+        term_offsets (np.ndarray): Where the postings of each term start in `docs`, with their total number at the end
+        docs (np.ndarray): The document ids of all postings
+        tfs (np.ndarray): The term frequency of all postings
+        positions (np.ndarray): The positions of all postings
+        doc_nums (list): The document number of each document id
+    """
+
+    def __init__(self, terms, term_offsets, docs, tfs, positions, doc_nums):
+        self.doc_nums = doc_nums
+        self._term_ids = {term: term_id for term_id, term in enumerate(terms)}
+        self._term_offsets = term_offsets
+        self._docs = docs
+        self._tfs = tfs
+        self._positions = positions
+        # Where the positions of every posting start, with the total number of positions at the end
+        self._position_offsets = np.zeros(len(tfs) + 1, dtype=np.int64)
+        np.cumsum(tfs, out=self._position_offsets[1:])
+        # The number of terms of each document
+        self.doc_lengths = np.bincount(docs, weights=tfs, minlength=len(doc_nums)).astype(np.int64)
+        self.avg_doc_length = float(self.doc_lengths.mean()) if len(doc_nums) else 0.0
+        self.doc_norms = tfidf_norms(docs, tfs, np.diff(term_offsets), len(doc_nums))
+
+    @classmethod
+    def from_dict(cls, inverted_index, doc_nums):
+        """Creates the index from a dict of terms with dicts of document ids and positions as values"""
+        terms = sorted(inverted_index.keys())
+        term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum([len(inverted_index[term]) for term in terms], out=term_offsets[1:])
+
+        docs, tfs, positions = [], [], []
+        for term in terms:
+            for doc_id, doc_positions in inverted_index[term].items():
+                docs.append(doc_id)
+                tfs.append(len(doc_positions))
+                positions.extend(doc_positions)
+
+        return cls(terms, term_offsets, np.array(docs, dtype=np.int32), np.array(tfs, dtype=np.int32),
+                   np.array(positions, dtype=np.int32), doc_nums)
+
+    def __getitem__(self, term):
+        term_id = self._term_ids[term]
+        start, end = self._term_offsets[term_id], self._term_offsets[term_id + 1]
+        position_offsets = self._position_offsets[start:end + 1]
+        positions = self._positions[position_offsets[0]:position_offsets[-1]]
+        return Postings(self._docs[start:end], self._tfs[start:end], positions, position_offsets - position_offsets[0])
+
+    def __contains__(self, term):
+        return term in self._term_ids
+
+    def __iter__(self):
+        return iter(self._term_ids)
+
+    def __len__(self):
+        return len(self._term_ids)
+
+    def cf(self, term):
+        """Collection frequency of a term, like IndexReader.cf"""
+        term_id = self._term_ids[term]
+        start, end = self._term_offsets[term_id], self._term_offsets[term_id + 1]
+        return int(self._position_offsets[end] - self._position_offsets[start])
+
+    def term_id(self, term):
+        """The index of a term in the sorted term dictionary"""
+        return self._term_ids[term]
+
+    def df(self, term):
+        term_id = self._term_ids[term]
+        return int(self._term_offsets[term_id + 1] - self._term_offsets[term_id])
+
+    def intersect_docs(self, term, doc_ids):
+        """Finds which documents of a sorted array contain a term, like IndexReader.intersect_docs"""
+        return intersect_sorted(doc_ids, self[term].docs)
+
+    def intersect_postings(self, term, doc_ids, with_positions=True):
+        """The postings of a term in the documents of a sorted array, like IndexReader.intersect_postings"""
+        postings = self[term]
+        return postings.select(find_sorted(postings.docs, doc_ids)), postings.df
+
+    def max_tfidf(self, term):
+        """The highest TFIDF weight of a term in any document, like IndexReader.max_tfidf"""
+        postings = self[term]
+        return float((1 + np.log10(postings.tfs.max())) * np.log10(len(self.doc_nums) / postings.df))
+
+    def doc_arrays(self):
+        """The term offsets, document ids and term frequencies of all postings, like IndexReader.doc_arrays"""
+        return self.arrays()[:3]
+
+    def arrays(self):
+        """The flat arrays of the index: the term offsets, document ids, term frequencies and positions"""
+        return self._term_offsets, self._docs, self._tfs, self._positions
+
+
+def tfidf_norms(docs, tfs, dfs, n_docs):
+    """The length of the TFIDF vector of every document, with the weights (1 + log10(tf)) * log10(N / df)
+    Args:
+        docs (np.ndarray): The document ids of the postings of all terms
+        tfs (np.ndarray): The term frequency of all postings
+        dfs (np.ndarray): The document frequency of every term
+        n_docs (int): The number of documents in the collection
+    Returns:
+        (np.ndarray): The norm of every document
+    """
+    weights = (1 + np.log10(tfs)) * np.repeat(np.log10(n_docs / np.maximum(dfs, 1)), dfs)
+    return np.sqrt(np.bincount(docs, weights=weights ** 2, minlength=n_docs))
+
+
+def find_sorted(docs, doc_ids):
+    """The indices in a sorted array of document ids of the ids of another sorted array that it contains"""
+    indices = np.searchsorted(docs, doc_ids)
+    found = indices < len(docs)
+    found[found] = docs[indices[found]] == doc_ids[found]
+    return indices[found]
+
+
+def intersect_sorted(docs_1, docs_2):
+    """Intersects two sorted arrays of document ids. Every id of the shorter array is binary searched in the longer
+    one, so the cost depends on the length of the shorter array
+    Args:
+        docs_1 (np.ndarray)
+        docs_2 (np.ndarray)
+    Returns:
+        (np.ndarray): The sorted common document ids
+    """
+    short_docs, long_docs = (docs_1, docs_2) if len(docs_1) <= len(docs_2) else (docs_2, docs_1)
+    if len(short_docs) == 0:
+        return short_docs
+
+    indices = np.searchsorted(long_docs, short_docs)
+    found = indices < len(long_docs)
+    found[found] = long_docs[indices[found]] == short_docs[found]
+    return short_docs[found]
+
+
+def union_sorted(docs_1, docs_2):
+    """The sorted union of two sorted arrays of document ids"""
+    if len(docs_1) == 0 or len(docs_2) == 0:
+        return docs_2 if len(docs_1) == 0 else docs_1
+    return np.union1d(docs_1, docs_2)
+
+
+def difference_sorted(docs_1, docs_2):
+    """The document ids of docs_1 that are not in docs_2. The cost depends on the length of docs_1"""
+    if len(docs_1) == 0 or len(docs_2) == 0:
+        return docs_1
+
+    indices = np.searchsorted(docs_2, docs_1)
+    found = indices < len(docs_2)
+    found[found] = docs_2[indices[found]] == docs_1[found]
+    return docs_1[~found]
@@ -1,7 +1,16 @@
 import re
+import os.path
+from collections import OrderedDict
 from stemming.porter2 import stem
 
 
+# Maximum number of words kept in the stem cache. The word frequencies are Zipfian, so a few thousand words cover most
+# of the tokens
+STEM_CACHE_SIZE = 1 << 16
+_stem_cache = OrderedDict()
+_new_stems = []
+
+
 def tokenise(text):
     """Removes punctuation, new lines, multiple whitespaces and the initial
     FT in front of the headlines and then splits it into tokens
@@ -22,6 +31,25 @@ def tokenise(text):
     return tokenised
 
 
+def tokenise_with_offsets(text):
+    """Splits the text into the same tokens as tokenise, along with where each token is found in the text
+    Args:
+        text (string): The text provided to tokenise
+    Returns:
+        tokenised (list): List of tokens
+        offsets (list): The (start, end) character offsets of each token in the text
+    """
+    # Blank the characters tokenise removes without changing the length of the text, so the offsets are kept. The FT
+    # abbreviation with its two whitespaces is always four characters long
+    blank_text = re.sub(r'^FT\s{2}', '    ', text, flags=re.MULTILINE)
+    blank_text = re.sub(r'([^\w\s])|(\_)', ' ', blank_text)
+    matches = list(re.finditer(r'\S+', blank_text))
+    if not matches:
+        # tokenise returns a single empty token for a text without words
+        return [''], [(0, 0)]
+    return [match.group().lower() for match in matches], [match.span() for match in matches]
+
+
 def remove_stop_words(words, stop_words):
     """Remove stop words
     Args:
@@ -33,6 +61,59 @@ def remove_stop_words(words, stop_words):
     return words
 
 
+def cached_stem(word):
+    """Porter2 stem of a word. The stems are kept in an LRU cache of STEM_CACHE_SIZE words, so the frequent words are
+    only stemmed once
+    Args:
+        word (str)
+    Returns:
+        (str): The stem of the word
+    """
+    if word in _stem_cache:
+        _stem_cache.move_to_end(word)
+        return _stem_cache[word]
+
+    stemmed = stem(word)
+    _stem_cache[word] = stemmed
+    if len(_new_stems) < STEM_CACHE_SIZE:
+        _new_stems.append((word, stemmed))
+    if len(_stem_cache) > STEM_CACHE_SIZE:
+        _stem_cache.popitem(last=False)
+    return stemmed
+
+
+def new_stems():
+    """The (word, stem) pairs stemmed since the last call, at most STEM_CACHE_SIZE of them, e.g. to send the stems of
+    a worker process to the parent"""
+    stems = list(_new_stems)
+    del _new_stems[:]
+    return stems
+
+
+def add_stems(stems):
+    """Adds (word, stem) pairs to the stem cache, keeping its size bounded"""
+    for word, stemmed in stems:
+        _stem_cache[word] = stemmed
+        _stem_cache.move_to_end(word)
+    while len(_stem_cache) > STEM_CACHE_SIZE:
+        _stem_cache.popitem(last=False)
+
+
+def save_stem_table(file_name):
+    """Saves the stem cache as lines of tab separated words and stems, from the least to the most recently used"""
+    with open(file_name + '.stems', 'w') as f:
+        for word, stemmed in _stem_cache.items():
+            f.write(word + '\t' + stemmed + '\n')
+    print('Stem table of {} words saved at {}.stems\n'.format(len(_stem_cache), file_name))
+
+
+def load_stem_table(file_name):
+    """Warm starts the stem cache from a stem table saved by save_stem_table, if it exists"""
+    if os.path.exists(file_name + '.stems'):
+        with open(file_name + '.stems') as f:
+            add_stems(line.rstrip('\n').split('\t') for line in f)
+
+
 def stemming(words):
     """Applies Porter stemmer
     Args:
@@ -40,4 +121,4 @@ def stemming(words):
     Returns:
         (list): Normalised list of prepeocessed words
     """
-    return list([stem(word) for word in words])
+    return [cached_stem(word) for word in words]
@@ -0,0 +1,92 @@
+import re
+
+
+QUERY_TOKEN_REGEX = re.compile(r'#\d+\s*\([^)]*\)|"[^"]*"|[()]|[^\s()"]+')
+PROXIMITY_REGEX = re.compile(r'#(\d+)\s*\(([^)]*)\)')
+WORD_REGEX = re.compile(r'[^\W_]+')
+LOGICAL_OPERATORS = ('and', 'or', 'not')
+
+
+def tokenise_query(query):
+    """Splits a boolean query into operators, parentheses, phrases, proximity searches and terms
+    Args:
+        query (str)
+    Returns:
+        (list): The tokens of the query
+    """
+    return QUERY_TOKEN_REGEX.findall(query.lower())
+
+
+def parse_query(query):
+    """Parses a boolean query into a syntax tree. NOT binds tighter than AND, which binds tighter than OR, and
+    parentheses group sub-queries. Adjacent operands without an operator between them are combined with AND.
+    The nodes of the tree are tuples:
+        ('term', word)
+        ('phrase', words)               for "word word ..."
+        ('proximity', distance, words)  for #distance(word, word, ...)
+        ('not', node)
+        ('and', left node, right node)
+        ('or', left node, right node)
+    Args:
+        query (str)
+    Returns:
+        (tuple): The root node of the syntax tree
+    Raises:
+        ValueError: If the query is not a valid boolean query
+    """
+    tokens = tokenise_query(query)
+    node, index = parse_or(tokens, 0)
+
+    if index < len(tokens):
+        raise ValueError('Unexpected "{}" in query: {}'.format(tokens[index], query))
+    return node
+
+
+def parse_or(tokens, index):
+    left, index = parse_and(tokens, index)
+
+    while index < len(tokens) and tokens[index] == 'or':
+        right, index = parse_and(tokens, index + 1)
+        left = ('or', left, right)
+    return left, index
+
+
+def parse_and(tokens, index):
+    left, index = parse_not(tokens, index)
+
+    while index < len(tokens) and tokens[index] not in ('or', ')'):
+        if tokens[index] == 'and':
+            index += 1
+        right, index = parse_not(tokens, index)
+        left = ('and', left, right)
+    return left, index
+
+
+def parse_not(tokens, index):
+    if index < len(tokens) and tokens[index] == 'not':
+        operand, index = parse_not(tokens, index + 1)
+        return ('not', operand), index
+    return parse_operand(tokens, index)
+
+
+def parse_operand(tokens, index):
+    if index >= len(tokens):
+        raise ValueError('Incomplete query: {}'.format(' '.join(tokens)))
+
+    token = tokens[index]
+    if token == '(':
+        node, index = parse_or(tokens, index + 1)
+        if index >= len(tokens) or tokens[index] != ')':
+            raise ValueError('Missing closing parenthesis in query: {}'.format(' '.join(tokens)))
+        return node, index + 1
+
+    if token.startswith('#'):  # Proximity search
+        distance, terms = PROXIMITY_REGEX.match(token).groups()
+        return ('proximity', int(distance), WORD_REGEX.findall(terms)), index + 1
+
+    if token.startswith('"'):  # Phrase search
+        return ('phrase', WORD_REGEX.findall(token)), index + 1
+
+    if token in LOGICAL_OPERATORS or token == ')':
+        raise ValueError('Unexpected "{}" in query: {}'.format(token, ' '.join(tokens)))
+    return ('term', token), index + 1
@@ -0,0 +1,111 @@
+import re
+from collections import Counter
+import numpy as np
+
+
+# Number of positions of a document shown in a snippet
+SNIPPET_WINDOW = 20
+HIGHLIGHT = ('[', ']')
+
+
+def densest_window(term_positions, window_size):
+    """Finds the window of window_size consecutive positions with the most distinct query terms, and then with the
+    most occurrences of them. The occurrences are sorted once and the window slides from one occurrence to the next
+    Args:
+        term_positions (list): The sorted positions of each query term in the document
+        window_size (int)
+    Returns:
+        (np.ndarray): The sorted positions of the occurrences in the best window
+    """
+    positions = np.concatenate(term_positions)
+    terms = np.repeat(np.arange(len(term_positions)), [len(term) for term in term_positions])
+    order = np.argsort(positions, kind='stable')
+    positions, terms = positions[order].tolist(), terms[order].tolist()
+
+    window_terms = Counter()
+    best_score, best_window = (0, 0), (0, 0)
+    end = 0
+    for start in range(len(positions)):
+        while end < len(positions) and positions[end] < positions[start] + window_size:
+            window_terms[terms[end]] += 1
+            end += 1
+
+        score = (len(window_terms), end - start)
+        if score > best_score:
+            best_score, best_window = score, (start, end)
+
+        window_terms[terms[start]] -= 1
+        if window_terms[terms[start]] == 0:
+            del window_terms[terms[start]]
+
+    return np.array(positions[best_window[0]:best_window[1]], dtype=np.int64)
+
+
+def query_snippet(query_tokens, doc_id, inverted_index, forward_index, doc_store, window_size=SNIPPET_WINDOW,
+                  highlight=HIGHLIGHT):
+    """Creates the snippet of a document for a query. The positions of the query terms in the document are read from
+    their postings and the densest window of them is mapped to the text of the document with the token offsets of the
+    forward index, so the document is neither tokenised again nor searched as a whole
+    Args:
+        query_tokens (list): The preprocessed query
+        doc_id (int)
+        inverted_index (IndexReader)
+        forward_index (ForwardIndex): Saved with the token offsets
+        doc_store (DocStore)
+        window_size (int): The number of positions of the document in the snippet
+        highlight (tuple): The strings inserted before and after every query term
+    Returns:
+        (str): The text of the window, with the query terms highlighted
+    """
+    term_positions = [inverted_index[term].positions_in(doc_id) for term in set(query_tokens) if term in inverted_index]
+    term_positions = [positions for positions in term_positions if len(positions)]
+    doc_length = int(forward_index.doc_lengths[doc_id])
+
+    # Without query terms the snippet is the beginning of the document
+    hits = densest_window(term_positions, window_size) if term_positions else np.zeros(0, dtype=np.int64)
+    first, last = (int(hits[0]), int(hits[-1])) if len(hits) else (1, 1)
+
+    # Centre the occurrences in the window, without going past the ends of the document
+    start = max(1, first - (window_size - (last - first + 1)) // 2)
+    end = min(doc_length, start + window_size - 1)
+    start = max(1, end - window_size + 1)
+
+    starts, ends = forward_index.token_offsets(doc_id, np.concatenate(([start, end], hits)))
+    text = doc_store.text(doc_id)
+
+    pieces = []
+    offset = int(starts[0])
+    for hit_start, hit_end in zip(starts[2:].tolist(), ends[2:].tolist()):
+        pieces.extend((text[offset:hit_start], highlight[0], text[hit_start:hit_end], highlight[1]))
+        offset = hit_end
+    pieces.append(text[offset:int(ends[1])])
+
+    snippet = re.sub(r'\s+', ' ', ''.join(pieces)).strip()
+    return ('... ' if start > 1 else '') + snippet + (' ...' if end < doc_length else '')
+
+
+def query_snippets(query_tokens, doc_ids, inverted_index, forward_index, doc_store, window_size=SNIPPET_WINDOW):
+    """The snippets of the results of a query, e.g. its top ranked documents"""
+    return [query_snippet(query_tokens, doc_id, inverted_index, forward_index, doc_store, window_size)
+            for doc_id in doc_ids]
+
+
+def save_snippets(queries, ranked_results, doc_nums, inverted_index, forward_index, doc_store, file_name, top_k=10):
+    """Saves the snippets of the top_k results of each ranked query
+    Args:
+        queries (list): The preprocessed ranked queries
+        ranked_results (dict): The (document id, score) pairs of each query, from the ranked retrieval
+        doc_nums (list): The document number of each document id
+        inverted_index (IndexReader)
+        forward_index (ForwardIndex)
+        doc_store (DocStore)
+        file_name (str)
+        top_k (int)
+    """
+    with open(file_name + '.txt', 'w') as f:
+        for query, query_tokens in zip(ranked_results.keys(), queries):
+            doc_ids = [doc for doc, _ in ranked_results[query][:top_k]]
+            for doc, snippet in zip(doc_ids, query_snippets(query_tokens, doc_ids, inverted_index, forward_index,
+                                                            doc_store)):
+                f.write(str(query) + ' ' + doc_nums[doc] + ' ' + snippet + '\n')
+    print('Snippets saved at {}.txt'.format(file_name))
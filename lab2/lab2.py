@@ -4,7 +4,7 @@ import pickle
 import xml.etree.ElementTree as ElementTree
 import ast
 from collections import Counter
-from preprocess import tokenise, remove_stop_words, normalise
+from preprocess import tokenise, remove_stop_words, normalise, save_stem_table, load_stem_table
 from index_search import create_term_doc_collection, boolean_search_queries, save_boolean_search_results, ranked_retrieval, save_ranked_retrieval_results
 
 
@@ -27,13 +27,37 @@ def preprocess(doc):
     return normalise(remove_stop_words(tokenise(doc), stop_words))
 
 
+def read_xml_chunks(xml_file, chunk_size=1 << 16):
+    """Reads the xml file in chunks, wrapped in a root tag since the TREC files have multiple top level documents"""
+    yield '<ROOT>'
+    with open(xml_file, 'r') as f:
+        for chunk in iter(lambda: f.read(chunk_size), ''):
+            yield chunk
+    yield '</ROOT>'
+
+
 def load_xml(xml_file, tag):
-    with open(xml_file, 'r') as xml_file:   # Read xml file
-        xml = xml_file.read()
+    """Streams the documents of a TREC xml file. The file is fed to an incremental parser chunk by chunk and each
+    document is cleared from the tree as soon as it has been parsed, so memory usage does not grow with the collection
+    Args:
+        xml_file (str): The path of the TREC xml file
+        tag (str): The tag of the document elements
+    Yields:
+        (tuple): The DOCNO, HEADLINE and TEXT of each document
+    """
+    parser = ElementTree.XMLPullParser(events=('start', 'end'))
+    root = None
+
+    for xml_chunk in read_xml_chunks(xml_file):
+        parser.feed(xml_chunk)
 
-    xml = '<ROOT>' + xml + '</ROOT>'   # Add a root tag
-    root = ElementTree.fromstring(xml)
-    return root
+        for event, element in parser.read_events():
+            if root is None:
+                root = element
+            elif event == 'end' and element.tag == tag:
+                yield element.findtext('DOCNO'), element.findtext('HEADLINE'), element.findtext('TEXT')
+                root.clear()    # Drop the documents that have already been yielded
+    parser.close()
 
 
 def word_freq_in_doc(doc):
@@ -74,6 +98,7 @@ def create_inverted_index(tokenised_docs):
     # return inverted_index
     save_inverted_index_txt(inverted_index, INVERTED_INDEX_FILE)
     save_file_binary(inverted_index, INVERTED_INDEX_FILE)
+    save_stem_table(INVERTED_INDEX_FILE)
 
 
 def save_inverted_index_txt(inverted_index, file_name):
@@ -140,17 +165,16 @@ if __name__ == '__main__':
     with open(QUERIES_RANKED) as queries_ranked_file:
         queries_ranked = [query.lower().split(' ', 1)[1] for query in queries_ranked_file]
 
+    # Warm start the stem cache with the stems saved with the previous index
+    load_stem_table(INVERTED_INDEX_FILE)
+
     # Load the provided trec sample xml
-    root = load_xml(TREC_SAMPLE_FILE, './DOC')
     doc_list = []
     tokenised_docs = {}
     doc_nums = []
     test_list = []
 
-    for doc in root:
-        doc_no = doc.find('DOCNO').text
-        headline = doc.find('HEADLINE').text
-        text = doc.find('TEXT').text
+    for doc_no, headline, text in load_xml(TREC_SAMPLE_FILE, 'DOC'):
         headline_with_text = headline + ' ' + text
 
         doc_nums.append(doc_no)
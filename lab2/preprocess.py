@@ -1,7 +1,15 @@
 import re
+import os.path
+from collections import OrderedDict
 from stemming.porter2 import stem
 
 
+# Maximum number of words kept in the stem cache. The word frequencies are Zipfian, so a few thousand words cover most
+# of the tokens
+STEM_CACHE_SIZE = 1 << 16
+_stem_cache = OrderedDict()
+
+
 def tokenise(text):
     """Removes punctuation, new lines, multiple whitespaces and the initial
     FT in front of the headlines and then splits it into tokens
@@ -33,6 +41,49 @@ def remove_stop_words(words, stop_words):
     return words
 
 
+def cached_stem(word):
+    """Porter2 stem of a word. The stems are kept in an LRU cache of STEM_CACHE_SIZE words, so the frequent words are
+    only stemmed once
+    Args:
+        word (str)
+    Returns:
+        (str): The stem of the word
+    """
+    if word in _stem_cache:
+        _stem_cache.move_to_end(word)
+        return _stem_cache[word]
+
+    stemmed = stem(word)
+    _stem_cache[word] = stemmed
+    if len(_stem_cache) > STEM_CACHE_SIZE:
+        _stem_cache.popitem(last=False)
+    return stemmed
+
+
+def add_stems(stems):
+    """Adds (word, stem) pairs to the stem cache, keeping its size bounded"""
+    for word, stemmed in stems:
+        _stem_cache[word] = stemmed
+        _stem_cache.move_to_end(word)
+    while len(_stem_cache) > STEM_CACHE_SIZE:
+        _stem_cache.popitem(last=False)
+
+
+def save_stem_table(file_name):
+    """Saves the stem cache as lines of tab separated words and stems, from the least to the most recently used"""
+    with open(file_name + '.stems', 'w') as f:
+        for word, stemmed in _stem_cache.items():
+            f.write(word + '\t' + stemmed + '\n')
+    print('Stem table of {} words saved at {}.stems\n'.format(len(_stem_cache), file_name))
+
+
+def load_stem_table(file_name):
+    """Warm starts the stem cache from a stem table saved by save_stem_table, if it exists"""
+    if os.path.exists(file_name + '.stems'):
+        with open(file_name + '.stems') as f:
+            add_stems(line.rstrip('\n').split('\t') for line in f)
+
+
 def normalise(words):
     """Porter stemmer
     Args:
@@ -40,4 +91,4 @@ def normalise(words):
     Returns:
         (list): Normalised list of prepeocessed words
     """
-    return list([stem(word) for word in words])
+    return [cached_stem(word) for word in words]
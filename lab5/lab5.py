@@ -1,90 +1,160 @@
+import os.path
 import pickle
-import xml.etree.ElementTree as ElementTree
-import operator
+import sys
+import time
 import numpy as np
-from collections import Counter
 from preprocess import tokenise, remove_stop_words, stemming
 
+# The binary index and the forward index are shared with assignment_1. Its directory is appended, so the preprocess
+# module of the lab is still the one imported
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assignment_1'))
+from postings import PostingsIndex  # noqa: E402
+from index_storage import save_index_binary, IndexReader  # noqa: E402
+from forward_index import save_forward_index, ForwardIndex  # noqa: E402
+
 
 def preprocess(doc):
     return stemming(remove_stop_words(tokenise(doc), stop_words))
 
 
-def load_xml(xml_file, tag):
-    with open(xml_file, 'r') as xml_file:   # Read xml file
-        xml = xml_file.read()
-
-    xml = '<ROOT>' + xml + '</ROOT>'   # Add a root tag
-    root = ElementTree.fromstring(xml)
-    return root
-
-
 def load_file_binary(file_name):
     with open(file_name + '.pkl', 'rb') as f:
         return pickle.load(f)
 
 
-def load_docs_from_trec(root):
-    # Load the provided trec sample xml
-    root = load_xml(TREC_SAMPLE_FILE, './DOC')
-    doc_list = []
-    token_doc_list = []
-    tokenised_docs = {}
-    doc_nums = []
-    test_list = []
-
-    for doc in root:
-        doc_no = doc.find('DOCNO').text
-        headline = doc.find('HEADLINE').text
-        text = doc.find('TEXT').text
-        headline_with_text = headline + ' ' + text
-
-        doc_nums.append(doc_no)
-        doc_list.append(headline_with_text)
-        test_list.append(tokenise(headline_with_text))
-        token_doc_list.append(preprocess(headline_with_text))
-        tokenised_docs[doc_no] = preprocess(headline_with_text)
-
-    return doc_nums, token_doc_list, tokenised_docs
-
+def save_index(inverted_index, file_name):
+    """Saves the pickled positional index of the lab as the binary index and the forward index of assignment_1. The
+    documents get dense ids in the order of their document numbers
+    Args:
+        inverted_index (dict): The positions of every term in each document number
+        file_name (str)
+    """
+    doc_nums = sorted({doc_num for postings in inverted_index.values() for doc_num in postings}, key=int)
+    doc_ids = {doc_num: doc_id for doc_id, doc_num in enumerate(doc_nums)}
+    index = PostingsIndex.from_dict({term: {doc_ids[doc_num]: positions
+                                            for doc_num, positions in sorted(postings.items(), key=lambda x: int(x[0]))}
+                                     for term, postings in inverted_index.items()}, doc_nums)
+    save_index_binary(index, file_name)
+    save_forward_index(index, file_name)
+
+
+def first_occurrence(term, top_docs, inverted_index):
+    """The rank of the first top document that contains a term and the first position of the term in it"""
+    postings = inverted_index[term]
+    for rank, doc in enumerate(top_docs.tolist()):
+        positions = postings.positions_in(doc)
+        if len(positions):
+            return rank, int(positions[0])
+    return len(top_docs), 0
+
+
+def expansion_terms(top_docs, n_terms, terms, idf, inverted_index, forward_index):
+    """Scores the terms of the top ranked documents with tf * log10(N / df), where tf is the frequency of the term in
+    all the top documents, and keeps the best n_terms. Terms with equal scores keep the order in which they first
+    appear in the top documents
+    Args:
+        top_docs (np.ndarray): The ids of the top ranked documents, in rank order
+        n_terms (int)
+        terms (list): The term of every term id
+        idf (np.ndarray): The idf of every term
+        inverted_index (IndexReader)
+        forward_index (ForwardIndex)
+    Returns:
+        (list): The expansion terms
+    """
+    tfs = forward_index.term_counts(top_docs, len(terms))
+    candidates = np.flatnonzero(tfs)
+    term_scores = tfs[candidates] * idf[candidates]
+
+    # Only the terms that can make the cut are ordered by their first occurrence, which is read from their postings
+    if len(candidates) > n_terms:
+        kept = term_scores >= np.partition(term_scores, len(term_scores) - n_terms)[len(term_scores) - n_terms]
+        candidates, term_scores = candidates[kept], term_scores[kept]
+    ranked = sorted(zip((-term_scores).tolist(), candidates.tolist()),
+                    key=lambda x: (x[0], first_occurrence(terms[x[1]], top_docs, inverted_index)))
+    return [terms[term_id] for _, term_id in ranked[:n_terms]]
+
+
+def ranked_retrieval(query_weights, idf, inverted_index):
+    """Performs ranked IR based on TFIDF for a weighted query, term at a time over the postings of its terms
+    Args:
+        query_weights (dict): The weight of every term in the query
+        idf (np.ndarray): The idf of every term
+        inverted_index (IndexReader)
+    Returns:
+        (list): The (document id, score) pairs of the documents with any query term, on a descending order of score
+    """
+    n_docs = len(inverted_index.doc_nums)
+    scores = np.zeros(n_docs)
+    matched = np.zeros(n_docs, dtype=bool)
+    for term, weight in query_weights.items():
+        postings = inverted_index[term]
+        scores[postings.docs] += (1 + np.log10(postings.tfs)) * idf[inverted_index.term_id(term)] * weight
+        matched[postings.docs] = True
+
+    query_docs = np.flatnonzero(matched)
+    order = np.lexsort((query_docs, -scores[query_docs]))
+    return list(zip(query_docs[order].tolist(), scores[query_docs][order].tolist()))
+
+
+def pseudo_relevance_feedback(queries, ranked_docs, n_docs, n_terms, inverted_index, forward_index,
+                              expansion_weight=1.0):
+    """Expands the queries with the best terms of their top ranked documents and ranks the documents again with the
+    expanded queries, in the style of Rocchio: the expansion terms are added to the query vector with expansion_weight
+    Args:
+        queries (list): (query id, preprocessed query) pairs
+        ranked_docs (dict): The ranked document numbers of each query id, from the initial ranked retrieval
+        n_docs (int): The number of top ranked documents of each query used for the feedback
+        n_terms (int): The number of expansion terms
+        inverted_index (IndexReader)
+        forward_index (ForwardIndex)
+        expansion_weight (float)
+    Returns:
+        expanded_queries (list): The expansion terms of each query
+        ranked_scores (dict): The resulting document ids and the score for each expanded query
+    """
+    terms = list(inverted_index)
+    doc_ids = {doc_num: doc_id for doc_id, doc_num in enumerate(inverted_index.doc_nums)}
+    idf = np.log10(len(doc_ids) / np.array([inverted_index.df(term) for term in terms], dtype=np.float64))
+
+    expanded_queries = []
+    ranked_scores = {}
+    for query_id, query_tokens in queries:
+        # Get top ranked docs ids for each query
+        top_docs = np.array([doc_ids[doc_num] for doc_num in ranked_docs[query_id][:n_docs]], dtype=np.int64)
+        first_n_terms = expansion_terms(top_docs, n_terms, terms, idf, inverted_index, forward_index)
+        expanded_queries.append(first_n_terms)
+
+        query_weights = {}
+        for token in query_tokens:
+            if token in inverted_index:
+                query_weights[token] = query_weights.get(token, 0) + 1
+        for term in first_n_terms:
+            query_weights[term] = query_weights.get(term, 0) + expansion_weight
+        ranked_scores[query_id] = ranked_retrieval(query_weights, idf, inverted_index)
+
+    return expanded_queries, ranked_scores
+
+
+def top_n_d_terms(n_docs, n_terms, queries, ranked_docs, inverted_index, forward_index):
+    """Saves the expansion terms of the top n_terms terms of the top n_docs documents of each query and the ranked
+    results of the expanded queries
+    """
+    start = time.time()
+    expanded_queries, ranked_scores = pseudo_relevance_feedback(queries, ranked_docs, n_docs, n_terms,
+                                                                  inverted_index, forward_index)
+    print('Expanded {} queries with {} terms of {} documents in {:.2f}ms per query'.format(
+        len(queries), n_terms, n_docs, 1000 * (time.time() - start) / len(queries)))
 
-def term_tfidf_score(terms, N):
-    terms_freq = Counter(terms)
-    term_score_dict = dict()
-
-    for term in terms:
-        tf = terms_freq[term]  # Frequency of term in terms list
-        df = len(inverted_index[term].keys())  # Num of docs that contain this term
-        term_score = tf * np.log10(N / df)
-
-        if term not in term_score_dict:
-            term_score_dict[term] = term_score
-
-    sorted_scores = sorted(term_score_dict.items(), key=operator.itemgetter(1), reverse=True)
-    return sorted_scores
-
-
-def top_n_d_terms(n_docs, n_terms):
     with open('./results/Qm.' + str(n_docs) + '.' + str(n_terms) + '.txt', 'w') as f:
-        # Preprocess the queries for the ranked retrieval
-        with open(QUERIES_RANKED) as queries_ranked_file:
-            for query in queries_ranked_file:
-                query_id = query.split(' ')[0]
-                preprocessed_query = preprocess(query.split(' ', 1)[1])
-                f.write(str(query_id) + ' ' + ' '.join(preprocessed_query) + ' + ')
-
-                # Get top ranked docs ids for each query
-                query_docs = ranked_docs_for_queries[query_id][:n_docs]
-                concatenated_top_docs = []
-                for doc_id in query_docs:
-                    # Get document text for doc_id
-                    concatenated_top_docs.extend(tokenised_docs[doc_id])
-
-                term_scores = term_tfidf_score(concatenated_top_docs, len(doc_nums))
-                # Get only the first 5 terms
-                first_n_terms = [i[0] for i in term_scores[:n_terms]]
-                print(query, first_n_terms, '\n')
-                f.write(' '.join(first_n_terms) + '\n')
+        for (query_id, query_tokens), first_n_terms in zip(queries, expanded_queries):
+            f.write(str(query_id) + ' ' + ' '.join(query_tokens) + ' + ' + ' '.join(first_n_terms) + '\n')
+
+    doc_nums = inverted_index.doc_nums
+    with open('./results/results.ranked.Qm.' + str(n_docs) + '.' + str(n_terms) + '.txt', 'w') as f:
+        for query_id, query_scores in ranked_scores.items():
+            for doc, score in query_scores[:1000]:
+                f.write(str(query_id) + ' 0 ' + doc_nums[doc] + ' 0 ' + '%.4f' % score + ' 0 \n')
 
 
 if __name__ == '__main__':
@@ -93,19 +163,18 @@ if __name__ == '__main__':
     RESULTS_DIR = 'results/'
     # Data files
     STOP_WORDS_FILE = DATA_DIR + 'stop_words.txt'
-    TREC_SAMPLE_FILE = DATA_DIR + 'trec.sample.xml'
     QUERIES_BOOLEAN = DATA_DIR + 'queries.boolean.txt'
     QUERIES_RANKED = DATA_DIR + 'queries.ranked.txt'
+    INVERTED_INDEX_FILE = RESULTS_DIR + 'inverted_index'
+    # The (number of top documents, number of expansion terms) settings of the pseudo relevance feedback
+    PRF_SETTINGS = [(1, 1), (1, 5), (5, 10)]
 
     # Save stop words and boolean queries
     with open(STOP_WORDS_FILE) as file:
         stop_words = [word.strip() for word in file]
 
-    inverted_index = load_file_binary('./results/inverted_index')
-
-    # Load the provided trec sample xml
-    root = load_xml(TREC_SAMPLE_FILE, './DOC')
-    doc_nums, token_doc_list, tokenised_docs = load_docs_from_trec(root)
+    # The pickled index is saved as the binary index and the forward index, which are read memory-mapped
+    save_index(load_file_binary(INVERTED_INDEX_FILE), INVERTED_INDEX_FILE)
 
     ranked_docs_for_queries = dict()
     with open(RESULTS_DIR + 'results.ranked.txt', 'r') as f:
@@ -118,8 +187,10 @@ if __name__ == '__main__':
             else:
                 ranked_docs_for_queries[query_id] = [doc_id]
 
-    # Get the TOP_N_DOCS for each query
-    top_n_docs = 1
-    top_n_terms = 5
+    # Preprocess the queries for the ranked retrieval
+    with open(QUERIES_RANKED) as queries_ranked_file:
+        queries = [(query.split(' ')[0], preprocess(query.split(' ', 1)[1])) for query in queries_ranked_file]
 
-    top_n_d_terms(top_n_docs, top_n_terms)
+    with IndexReader(INVERTED_INDEX_FILE) as inverted_index, ForwardIndex(INVERTED_INDEX_FILE) as forward_index:
+        for top_n_docs, top_n_terms in PRF_SETTINGS:
+            top_n_d_terms(top_n_docs, top_n_terms, queries, ranked_docs_for_queries, inverted_index, forward_index)
@@ -1,7 +1,14 @@
 import re
+from collections import OrderedDict
 from stemming.porter2 import stem
 
 
+# Maximum number of words kept in the stem cache. The word frequencies are Zipfian, so a few thousand words cover most
+# of the tokens
+STEM_CACHE_SIZE = 1 << 16
+_stem_cache = OrderedDict()
+
+
 def tokenise(text):
     """Removes punctuation, new lines, multiple whitespaces and the initial
     FT in front of the headlines and then splits it into tokens
@@ -33,6 +40,25 @@ def remove_stop_words(words, stop_words):
     return words
 
 
+def cached_stem(word):
+    """Porter2 stem of a word. The stems are kept in an LRU cache of STEM_CACHE_SIZE words, so the frequent words are
+    only stemmed once
+    Args:
+        word (str)
+    Returns:
+        (str): The stem of the word
+    """
+    if word in _stem_cache:
+        _stem_cache.move_to_end(word)
+        return _stem_cache[word]
+
+    stemmed = stem(word)
+    _stem_cache[word] = stemmed
+    if len(_stem_cache) > STEM_CACHE_SIZE:
+        _stem_cache.popitem(last=False)
+    return stemmed
+
+
 def stemming(words):
     """Applies Porter stemmer
     Args:
@@ -40,4 +66,4 @@ def stemming(words):
     Returns:
         (list): Normalised list of prepeocessed words
     """
-    return list([stem(word) for word in words])
+    return [cached_stem(word) for word in words]